@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compares decoding the same PMS answer as XML (what PKC does by default) and
+as JSON via plex_json (setting "Download library data as JSON").
+
+Runs outside of Kodi. Either pass a pair of fixture files holding the very
+same PMS answer as XML and as JSON:
+
+    python benchmarks/json_transport.py section.xml section.json
+
+or let the script download the pair from your PMS first, optionally saving
+it as fixtures <prefix>.xml and <prefix>.json:
+
+    python benchmarks/json_transport.py \\
+        --url 'http://192.168.1.2:32400/library/sections/1/all' \\
+        --token <X-Plex-Token> --save section
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import urllib.request
+import xml.etree.ElementTree as etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'resources', 'lib'))
+import plex_json  # noqa: E402
+
+
+def download(url, token, accept):
+    request = urllib.request.Request(url, headers={'X-Plex-Token': token,
+                                                   'Accept': accept})
+    with urllib.request.urlopen(request) as answer:
+        return answer.read()
+
+
+def traverse(xml):
+    """
+    Touches what library sync touches: a few attributes of every item and of
+    its Media, Part and Stream elements
+    """
+    count = 0
+    for item in xml:
+        item.get('ratingKey')
+        item.get('updatedAt')
+        item.get('title')
+        for media in item.iterfind('Media'):
+            media.get('videoResolution')
+            for part in media:
+                part.get('file')
+                for stream in part:
+                    stream.get('codec')
+                    count += 1
+        count += 1
+    return count
+
+
+def measure(name, decode, content, repeat):
+    decode_times = []
+    total_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        xml = decode(content)
+        decoded = time.perf_counter()
+        elements = traverse(xml)
+        decode_times.append(decoded - start)
+        total_times.append(time.perf_counter() - start)
+    del xml
+    tracemalloc.start()
+    xml = decode(content)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-5s %8.1f KiB  decode %8.2f ms  decode+traverse %8.2f ms  '
+          'peak memory %8.1f KiB  %s elements'
+          % (name,
+             len(content) / 1024.0,
+             min(decode_times) * 1000,
+             min(total_times) * 1000,
+             peak / 1024.0,
+             elements))
+    return min(total_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('xml_file', nargs='?')
+    parser.add_argument('json_file', nargs='?')
+    parser.add_argument('--url', help='PMS url to download the fixtures from')
+    parser.add_argument('--token', default='', help='X-Plex-Token')
+    parser.add_argument('--save', metavar='PREFIX',
+                        help='save the downloaded fixtures')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    if args.url:
+        xml_content = download(args.url, args.token, 'application/xml')
+        json_content = download(args.url, args.token, plex_json.MIME_TYPE)
+        if args.save:
+            with open(args.save + '.xml', 'wb') as f:
+                f.write(xml_content)
+            with open(args.save + '.json', 'wb') as f:
+                f.write(json_content)
+    elif args.xml_file and args.json_file:
+        with open(args.xml_file, 'rb') as f:
+            xml_content = f.read()
+        with open(args.json_file, 'rb') as f:
+            json_content = f.read()
+    else:
+        parser.error('Pass the fixture files or --url')
+    xml_time = measure('XML', etree.fromstring, xml_content, args.repeat)
+    json_time = measure('JSON', plex_json.loads, json_content, args.repeat)
+    print('JSON takes %.0f%% of the time of XML' % (json_time / xml_time * 100))
+
+
+if __name__ == '__main__':
+    main()
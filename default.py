@@ -8,6 +8,7 @@ import xbmcgui
 import xbmcplugin
 
 from resources.lib import entrypoint, utils, transfer, variables as v, loghandler
+from resources.lib import http_cache
 
 
 loghandler.config()
@@ -73,6 +74,10 @@ def triage(mode, params, path, arguments, itemid):
         LOG.info('User requested fanarttv refresh')
         transfer.plex_command('fanart-scan')
         return
+    elif mode == 'http_stats':
+        LOG.info('User requested PMS request statistics')
+        transfer.plex_command('http-stats')
+        return
     # Listings: we list ListItems and need to tell Kodi when we're done
     try:
         if mode == 'browseplex':
@@ -177,4 +182,6 @@ if __name__ == '__main__':
         LOG.error('Error: %s', err)
     else:
         main()
+        # Keep the cache's hit/miss counters of this plugin process
+        http_cache.flush_stats()
     LOG.info('%s stopped' % v.ADDON_ID)
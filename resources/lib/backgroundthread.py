@@ -119,7 +119,8 @@ class ProcessingQueue(queue.Queue, object):
     next queue. There's one queue per Section(). You need to initialize each
     section with add_section(section) first.
     Put tuples (count, item) into this queue, with count being the respective
-    position of the item in the queue, starting with 0 (zero).
+    position of the item in the queue, starting with 0 (zero). item needs to
+    carry its Section() as item.section
     (None, None) is the sentinel for a single queue being exhausted, added by
     add_sentinel()
     """
@@ -137,7 +138,7 @@ class ProcessingQueue(queue.Queue, object):
 
     def _put(self, item):
         for i, section in enumerate(self._sections):
-            if item[1]['section'] == section:
+            if item[1].section == section:
                 self._queues[i]._put(item)
                 break
         else:
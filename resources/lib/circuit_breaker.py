@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-host circuit breakers and per-request-class retry budgets for
+DownloadUtils.
+
+A host's circuit opens only after FAILURE_THRESHOLD connection errors or
+timeouts in a row - a single timeout during a heavy sync no longer declares
+the PMS dead. While open, requests to the host fail immediately. After a
+jittered, exponentially growing backoff, the circuit turns half-open and lets
+exactly one probe request through. Its success closes the circuit, its failure
+opens it again with a longer backoff.
+
+Retries of failed GETs are limited per request class (sync, widget, playback,
+companion): per request, and by a budget that every request of the class
+fills up a little and every retry drains. If the PMS goes down, retries thus
+can't multiply the load on it.
+"""
+from logging import getLogger
+from threading import Lock
+import random
+import time
+import urllib.parse
+
+from requests import exceptions
+
+LOG = getLogger('PLEX.circuit_breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Consecutive connection failures before we open the circuit
+FAILURE_THRESHOLD = 3
+# Seconds the circuit stays open the first time. Doubled every time the probe
+# fails, up to BACKOFF_CAP
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+# Seconds to wait before the first retry of a request. Doubled every retry
+RETRY_BASE = 0.5
+RETRY_CAP = 8.0
+
+# Request classes: (max retries per request, budget tokens added per request)
+# Widgets and Companion answers are only worth something when they're quick
+SYNC = 'sync'
+WIDGET = 'widget'
+PLAYBACK = 'playback'
+COMPANION = 'companion'
+OTHER = 'other'
+RETRY_POLICIES = {
+    SYNC: (2, 0.2),
+    PLAYBACK: (1, 0.5),
+    WIDGET: (0, 0.0),
+    COMPANION: (0, 0.0),
+    OTHER: (1, 0.1),
+}
+# Max. number of retries a class can save up
+MAX_BUDGET = 10.0
+
+
+class CircuitOpen(exceptions.ConnectionError):
+    """
+    Raised instead of sending a request to a host whose circuit is open
+    """
+    pass
+
+
+def backoff(attempt, base, cap):
+    """
+    Jittered exponential backoff in seconds for attempt 0, 1, ...: between
+    half and the full min(cap, base * 2**attempt)
+    """
+    delay = min(cap, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker(object):
+    def __init__(self, host):
+        self.host = host
+        self.lock = Lock()
+        self.state = CLOSED
+        self.failures = 0
+        # How many times in a row the circuit has been opened
+        self.trips = 0
+        self.retry_at = 0.0
+        self.probing = False
+        self.counters = {'successes': 0,
+                         'failures': 0,
+                         'rejected': 0,
+                         'opened': 0,
+                         'probes': 0}
+
+    def allow(self):
+        """
+        Returns True if a request to the host may be sent. You must then
+        report its outcome with success(), failure() or cancel()
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.time() >= self.retry_at:
+                LOG.info('Probing %s again', self.host)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                self.counters['probes'] += 1
+                return True
+            self.counters['rejected'] += 1
+            return False
+
+    def success(self):
+        """
+        The host answered (with any HTTP status code)
+        """
+        with self.lock:
+            self.counters['successes'] += 1
+            if self.state != CLOSED:
+                LOG.info('%s answered, closing its circuit', self.host)
+            self.state = CLOSED
+            self.failures = 0
+            self.trips = 0
+            self.probing = False
+
+    def failure(self):
+        """
+        Connection error or timeout. Returns True if the circuit is open now
+        """
+        with self.lock:
+            self.counters['failures'] += 1
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    self._open()
+            return self.state == OPEN
+
+    def cancel(self):
+        """
+        The request ended without telling us anything about the host
+        """
+        with self.lock:
+            if self.probing:
+                self.probing = False
+                if self.state == HALF_OPEN:
+                    # Let the next request probe right away
+                    self.state = OPEN
+
+    def _open(self):
+        delay = backoff(self.trips, BACKOFF_BASE, BACKOFF_CAP)
+        LOG.warn('%s failed %s times in a row, opening its circuit for %.1fs',
+                 self.host, self.failures, delay)
+        self.state = OPEN
+        self.trips += 1
+        self.retry_at = time.time() + delay
+        self.probing = False
+        self.counters['opened'] += 1
+
+    def is_open(self):
+        return self.state != CLOSED
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+            result['state'] = self.state
+        return result
+
+
+class RetryBudget(object):
+    def __init__(self, request_class):
+        self.max_retries, self.ratio = RETRY_POLICIES[request_class]
+        self.lock = Lock()
+        self.budget = MAX_BUDGET if self.ratio else 0.0
+        self.counters = {'requests': 0, 'retries': 0, 'denied': 0}
+
+    def deposit(self):
+        """
+        Call once per request
+        """
+        with self.lock:
+            self.counters['requests'] += 1
+            self.budget = min(MAX_BUDGET, self.budget + self.ratio)
+
+    def withdraw(self, attempt):
+        """
+        Returns True if the request may be retried for the attempt-th time
+        (starting with 1)
+        """
+        with self.lock:
+            if attempt > self.max_retries:
+                return False
+            if self.budget < 1:
+                self.counters['denied'] += 1
+                return False
+            self.budget -= 1
+            self.counters['retries'] += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            result = dict(self.counters)
+            result['budget'] = round(self.budget, 1)
+        return result
+
+
+_LOCK = Lock()
+_BREAKERS = {}
+_BUDGETS = {}
+
+
+def host(url):
+    """
+    Returns the '<host>:<port>' the circuit breaker for url is kept for
+    """
+    return urllib.parse.urlsplit(url).netloc.lower()
+
+
+def breaker(url):
+    """
+    Returns the CircuitBreaker for url's host
+    """
+    key = host(url)
+    with _LOCK:
+        try:
+            return _BREAKERS[key]
+        except KeyError:
+            _BREAKERS[key] = CircuitBreaker(key)
+            return _BREAKERS[key]
+
+
+def budget(request_class):
+    """
+    Returns the RetryBudget for request_class, see RETRY_POLICIES
+    """
+    if request_class not in RETRY_POLICIES:
+        request_class = OTHER
+    with _LOCK:
+        try:
+            return _BUDGETS[request_class]
+        except KeyError:
+            _BUDGETS[request_class] = RetryBudget(request_class)
+            return _BUDGETS[request_class]
+
+
+def stats():
+    """
+    Returns a dict with the counters of all circuit breakers and retry
+    budgets
+    """
+    with _LOCK:
+        breakers = list(_BREAKERS.values())
+        budgets = dict(_BUDGETS)
+    return {'hosts': {x.host: x.stats() for x in breakers},
+            'classes': {k: v.stats() for k, v in budgets.items()}}
@@ -9,6 +9,8 @@ from .exceptions import LockedDatabase
 DB_WRITE_ATTEMPTS = 100
 DB_WRITE_ATTEMPTS_TIMEOUT = 1  # in seconds
 DB_CONNECTION_TIMEOUT = 10
+# Page cache in KiB for bulk-loading connections
+BULK_CACHE_SIZE = 64000
 
 
 def catch_operationalerrors(method):
@@ -48,21 +50,31 @@ def catch_operationalerrors(method):
     return wrapper
 
 
-def _initial_db_connection_setup(conn):
+def _initial_db_connection_setup(conn, bulk):
     """
     Set-up DB e.g. for WAL journal mode, if that hasn't already been done
     before. Also start a transaction
     """
     conn.execute('PRAGMA journal_mode = WAL;')
-    conn.execute('PRAGMA cache_size = -8000;')
-    conn.execute('PRAGMA synchronous = NORMAL;')
+    if bulk:
+        conn.execute('PRAGMA cache_size = -%s;' % BULK_CACHE_SIZE)
+        conn.execute('PRAGMA synchronous = OFF;')
+        conn.execute('PRAGMA temp_store = MEMORY;')
+    else:
+        conn.execute('PRAGMA cache_size = -8000;')
+        conn.execute('PRAGMA synchronous = NORMAL;')
     conn.execute('BEGIN')
 
 
-def connect(media_type=None):
+def connect(media_type=None, bulk=False):
     """
     Open a connection to the Kodi database.
         media_type: 'video' (standard if not passed), 'plex', 'music', 'texture'
+                    or e.g. 'video-staging', see kodi_db.staging
+        bulk:       True to trade durability for speed while filling empty
+                    DBs, e.g. during the very first sync. Don't fsync at all.
+                    Only for plex.db and the staging DBs, never for Kodi's
+                    live DBs: a crash could corrupt them
     """
     if media_type == "plex":
         db_path = v.DB_PLEX_PATH
@@ -70,6 +82,10 @@ def connect(media_type=None):
         db_path = v.DB_PLEX_COPY_PATH
     elif media_type == "music":
         db_path = v.DB_MUSIC_PATH
+    elif media_type == 'video-staging':
+        db_path = v.DB_VIDEO_STAGING_PATH
+    elif media_type == 'music-staging':
+        db_path = v.DB_MUSIC_STAGING_PATH
     elif media_type == "texture":
         db_path = v.DB_TEXTURE_PATH
     else:
@@ -80,7 +96,7 @@ def connect(media_type=None):
     attempts = DB_WRITE_ATTEMPTS
     while True:
         try:
-            _initial_db_connection_setup(conn)
+            _initial_db_connection_setup(conn, bulk)
         except sqlite3.OperationalError as err:
             if 'database is locked' not in err:
                 # Not an error we want to catch, so reraise it
@@ -1,10 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from logging import getLogger
+from copy import deepcopy
+from threading import Event, Lock
+import time
+import urllib.parse
 import requests
 import requests.exceptions as exceptions
+import xbmc
 
-from . import utils, clientinfo, app
+from . import utils, clientinfo, app, backgroundthread, http_cache
+from . import plex_json, circuit_breaker, rate_limiter, http_stats
 
 ###############################################################################
 
@@ -14,9 +20,61 @@ requests.packages.urllib3.disable_warnings()
 
 LOG = getLogger('PLEX.download')
 
+# Connections we keep alive per host are sized to all threads that might hit
+# the PMS simultaneously: the syncThreadNumber metadata download threads, the
+# BGThreader workers downloading section chunks, the section iterators
+# full_sync builds at once (PREFETCH_SECTIONS) and some headroom for playback,
+# Companion, artwork and the websocket
+PREFETCH_CONNECTIONS = 4
+OTHER_CONNECTIONS = 4
+
+# Identical GETs currently in flight: {key: _Flight}
+_FLIGHTS = {}
+_FLIGHTS_LOCK = Lock()
+
 ###############################################################################
 
 
+class _Flight(object):
+    """
+    One GET in flight that concurrent callers for the very same request wait
+    for instead of hitting the PMS themselves
+    """
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+def _flight_key(url, parameters, headerOptions, verifySSL, timeout):
+    """
+    Normalizes the request: the order of the url's query and of parameters
+    does not matter
+    """
+    url = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(url.query, keep_blank_values=True)
+    if parameters:
+        query.extend((name, str(value)) for name, value in parameters.items())
+    return (url._replace(query='').geturl(),
+            tuple(sorted(query)),
+            tuple(sorted((headerOptions or {}).items())),
+            verifySSL,
+            timeout)
+
+
+def _copy_result(result):
+    """
+    Every caller gets its own copy of XML and JSON answers as callers might
+    alter them
+    """
+    if isinstance(result, (dict, list)) or hasattr(result, 'tag'):
+        return deepcopy(result)
+    return result
+
+
 class DownloadUtils(object):
     """
     Manages any up/downloads with PKC. Careful to initiate correctly
@@ -27,9 +85,7 @@ class DownloadUtils(object):
     # Borg - multiple instances, shared state
     _shared_state = {}
 
-    # How many failed attempts before declaring PMS dead?
-    connection_attempts = 1
-    count_error = 0
+    # PMS is declared dead once its circuit opens, see circuit_breaker
     # How many 401 returns before declaring unauthorized?
     unauthorized_attempts = 2
     count_unauthorized = 0
@@ -66,16 +122,31 @@ class DownloadUtils(object):
         # Set SSL settings
         self.setSSL()
 
+        # Share the PMS between sync and the user, see rate_limiter
+        rate_limiter.LIMITER.configure(
+            int(utils.settings('pmsRequestRate') or 0))
+
         # Counters to declare PMS dead or unauthorized
         if reset is True:
-            self.count_error = 0
             self.count_unauthorized = 0
 
+        # Our own headers replaced requests' defaults - PMS answers are
+        # highly compressible
+        self.s.headers['Accept-Encoding'] = 'gzip, deflate'
+
+        # Reuse connections (and their TLS handshakes) instead of dropping
+        # them as soon as more threads download than the pool holds.
         # Retry connections to the server
-        self.s.mount("http://", requests.adapters.HTTPAdapter(max_retries=1))
-        self.s.mount("https://", requests.adapters.HTTPAdapter(max_retries=1))
+        pool_size = self.pool_size()
+        self.s.mount("http://",
+                     requests.adapters.HTTPAdapter(pool_maxsize=pool_size,
+                                                   max_retries=1))
+        self.s.mount("https://",
+                     requests.adapters.HTTPAdapter(pool_maxsize=pool_size,
+                                                   max_retries=1))
 
-        LOG.debug("Requests session started on: %s", app.CONN.server)
+        LOG.debug("Requests session started on: %s with %s connections per "
+                  "host", app.CONN.server, pool_size)
 
     def stopSession(self):
         try:
@@ -88,6 +159,44 @@ class DownloadUtils(object):
             pass
         LOG.info('Request session stopped')
 
+    @staticmethod
+    def pool_size():
+        """
+        Number of connections to keep alive per host
+        """
+        return (int(utils.settings('syncThreadNumber')) +
+                backgroundthread.WORKER_COUNT +
+                PREFETCH_CONNECTIONS +
+                OTHER_CONNECTIONS)
+
+    def pool_stats(self):
+        """
+        Returns a dict {'<scheme>://<host>:<port>': {'connections': opened,
+        'requests': sent, 'idle': idle connections}} for the session's
+        connection pools. requests per connection tells how well we're
+        reusing connections
+        """
+        stats = {}
+        try:
+            adapters = list(self.s.adapters.values())
+        except AttributeError:
+            # No session
+            return stats
+        for adapter in adapters:
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    # Pool has just been evicted
+                    continue
+                stats['%s://%s:%s' % (pool.scheme, pool.host, pool.port)] = {
+                    'connections': pool.num_connections,
+                    'requests': pool.num_requests,
+                    'idle': pool.pool.qsize() if pool.pool else 0
+                }
+        return stats
+
     @staticmethod
     def getHeader(options=None):
         header = clientinfo.getXArgsDeviceInfo()
@@ -95,6 +204,65 @@ class DownloadUtils(object):
             header.update(options)
         return header
 
+    @staticmethod
+    def _retry_wait(delay):
+        """
+        Waits delay seconds before retrying. Returns True if Kodi is shutting
+        down instead
+        """
+        monitor = app.APP.monitor or xbmc.Monitor()
+        return monitor.waitForAbort(delay)
+
+    def _request(self, s, action_type, authenticate, request_class, kwargs):
+        """
+        Sends the request, guarded by the host's circuit breaker and the rate
+        limiter if authenticate is True. Retries GETs that failed to connect
+        or timed out within the retry budget of request_class
+        """
+        breaker = circuit_breaker.breaker(kwargs['url'])
+        budget = circuit_breaker.budget(request_class)
+        budget.deposit()
+        attempt = 0
+        while True:
+            if authenticate is True:
+                waited = rate_limiter.LIMITER.acquire(request_class)
+                if waited > 1:
+                    LOG.debug('Waited %.1fs for the rate limiter: %s',
+                              waited, kwargs['url'])
+            if authenticate is True and not breaker.allow():
+                raise circuit_breaker.CircuitOpen(breaker.host)
+            start = time.time()
+            try:
+                r = self._doDownload(s, action_type, **kwargs)
+                if authenticate is True:
+                    http_stats.record(kwargs['url'],
+                                      time.time() - start,
+                                      r.status_code,
+                                      len(r.content))
+            except (exceptions.ConnectionError, exceptions.Timeout) as err:
+                if authenticate is True:
+                    http_stats.record(kwargs['url'], time.time() - start)
+                breaker.failure()
+                attempt += 1
+                if (authenticate is not True or
+                        action_type != 'GET' or
+                        breaker.is_open() or
+                        not budget.withdraw(attempt)):
+                    raise
+                delay = circuit_breaker.backoff(attempt - 1,
+                                                circuit_breaker.RETRY_BASE,
+                                                circuit_breaker.RETRY_CAP)
+                LOG.info('Retrying %s in %.1fs (%s attempt), error: %s',
+                         kwargs['url'], delay, attempt, err)
+                if self._retry_wait(delay):
+                    raise
+            except BaseException:
+                breaker.cancel()
+                raise
+            else:
+                breaker.success()
+                return r
+
     @staticmethod
     def _doDownload(s, action_type, **kwargs):
         if action_type == "GET":
@@ -112,13 +280,28 @@ class DownloadUtils(object):
     def downloadUrl(self, url, action_type="GET", postBody=None,
                     parameters=None, authenticate=True, headerOptions=None,
                     verifySSL=True, timeout=None, return_response=False,
-                    headerOverride=None, reraise=False):
+                    headerOverride=None, reraise=False, revalidate=False,
+                    json_transport=False, request_class=None):
         """
         Override SSL check with verifySSL=False
 
         If authenticate=True, existing request session will be used/started
         Otherwise, 'empty' request will be made
 
+        Set revalidate=True for authenticated GETs to cache the PMS' answer on
+        disk and to only download it again if it changed, see http_cache
+
+        Set json_transport=True to ask the PMS for JSON instead of XML. You'll
+        receive a plex_json.JsonElement that behaves like the etree xml
+
+        Concurrent, identical authenticated GETs are coalesced: only the first
+        one is sent to the PMS, the others wait for and share its answer.
+        Not for return_response=True as a response can't be shared
+
+        request_class (circuit_breaker.SYNC, WIDGET, PLAYBACK, COMPANION or
+        None) determines how often a GET is retried if the PMS could not be
+        reached
+
         Returns:
             None              If an error occured
             True               If connection worked but no body was received
@@ -128,7 +311,64 @@ class DownloadUtils(object):
             json               json() object, if applicable
             <response-object>  if return_response=True is set (200, 201 only)
         """
+        if json_transport:
+            headerOptions = dict(headerOptions or {})
+            headerOptions['Accept'] = plex_json.MIME_TYPE
+        if (action_type != 'GET' or authenticate is not True or
+                return_response is True):
+            return self._download_url(url, action_type, postBody, parameters,
+                                      authenticate, headerOptions, verifySSL,
+                                      timeout, return_response,
+                                      headerOverride, reraise, revalidate,
+                                      request_class)
+        key = _flight_key(url, parameters, headerOptions, verifySSL, timeout)
+        with _FLIGHTS_LOCK:
+            flight = _FLIGHTS.get(key)
+            leader = flight is None
+            if leader:
+                flight = _FLIGHTS[key] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            LOG.debug('Waiting for identical request in flight: %s', url)
+            flight.done.wait()
+            if flight.error is not None:
+                if reraise:
+                    raise flight.error
+                return
+            return _copy_result(flight.result)
+        try:
+            # Always reraise: followers might want the exception even if we
+            # don't
+            flight.result = self._download_url(url, action_type, postBody,
+                                               parameters, authenticate,
+                                               headerOptions, verifySSL,
+                                               timeout, return_response,
+                                               headerOverride, True,
+                                               revalidate, request_class)
+        except BaseException as err:
+            flight.error = err
+        finally:
+            with _FLIGHTS_LOCK:
+                del _FLIGHTS[key]
+            flight.done.set()
+        if flight.error is not None:
+            if reraise:
+                raise flight.error
+            return
+        # Nobody can join anymore. Leave the original untouched for followers
+        return _copy_result(flight.result) if flight.followers \
+            else flight.result
+
+    def _download_url(self, url, action_type, postBody, parameters,
+                      authenticate, headerOptions, verifySSL, timeout,
+                      return_response, headerOverride, reraise, revalidate,
+                      request_class):
+        """
+        Does the actual up- or download, see downloadUrl
+        """
         kwargs = {'timeout': self.timeout}
+        cache_key = cached = None
         if authenticate is True:
             # Get requests session
             try:
@@ -139,6 +379,15 @@ class DownloadUtils(object):
                 s = self.s
             # Replace for the real values
             url = url.replace("{server}", app.CONN.server)
+            if revalidate and action_type == 'GET':
+                cache_key = http_cache.key(url,
+                                           parameters,
+                                           headerOptions,
+                                           s.headers.get('X-Plex-Token'))
+                cached = http_cache.load(cache_key)
+                if cached:
+                    headerOptions = dict(headerOptions or {})
+                    headerOptions.update(cached[0])
         else:
             # User is not (yet) authenticated. Used to communicate with
             # plex.tv and to check for PMS servers
@@ -168,9 +417,16 @@ class DownloadUtils(object):
         # ACTUAL DOWNLOAD HAPPENING HERE
         success = False
         try:
-            r = self._doDownload(s, action_type, **kwargs)
+            r = self._request(s, action_type, authenticate, request_class,
+                              kwargs)
+            if cache_key:
+                r = http_cache.process(cache_key, cached, r)
 
         # THE EXCEPTIONS
+        except circuit_breaker.CircuitOpen:
+            LOG.debug('Circuit open, not contacting %s', url)
+            if reraise:
+                raise
         except exceptions.SSLError as e:
             LOG.warn("Invalid SSL certificate for: %s", url)
             LOG.warn(e)
@@ -219,7 +475,6 @@ class DownloadUtils(object):
             success = True
             # We COULD contact the PMS, hence it ain't dead
             if authenticate is True:
-                self.count_error = 0
                 if r.status_code != 401:
                     self.count_unauthorized = 0
 
@@ -261,9 +516,24 @@ class DownloadUtils(object):
             elif r.status_code in (200, 201):
                 # 200: OK
                 # 201: Created
+                if (headerOptions and
+                        headerOptions.get('Accept') == plex_json.MIME_TYPE and
+                        plex_json.is_json(r.content)):
+                    try:
+                        start = time.time()
+                        xml = plex_json.loads(r.content)
+                        if authenticate is True:
+                            http_stats.record_parse(url, time.time() - start)
+                        return xml
+                    except ValueError:
+                        LOG.warn('Could not decode JSON answer for %s', url)
+                        return
                 try:
                     # xml response
+                    start = time.time()
                     r = utils.etree.fromstring(r.content)
+                    if authenticate is True:
+                        http_stats.record_parse(url, time.time() - start)
                     return r
                 except Exception:
                     r.encoding = 'utf-8'
@@ -299,8 +569,8 @@ class DownloadUtils(object):
             if not success and authenticate:
                 # Deal with the consequences of the exceptions
                 # Make the addon aware of status
-                self.count_error += 1
-                if self.count_error >= self.connection_attempts:
+                if (app.CONN.online and
+                        circuit_breaker.breaker(url).is_open()):
                     LOG.warn('Failed to connect to %s too many times. '
                              'Declare PMS dead', url)
                     app.CONN.online = False
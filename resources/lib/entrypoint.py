@@ -20,7 +20,7 @@ from .plex_api import API, mass_api
 from . import plex_functions as PF
 from . import variables as v
 # Be careful - your using app in another Python instance!
-from . import app, widgets
+from . import app, widgets, circuit_breaker
 from .library_sync.nodes import NODE_TYPES
 
 
@@ -529,7 +529,9 @@ def browse_plex(key=None, plex_type=None, section_id=None, synched=True,
             raise ListingException
         prompt = prompt.strip()
         args['query'] = prompt
-    xml = DU().downloadUrl(utils.extend_url('{server}%s' % key, args))
+    xml = DU().downloadUrl(utils.extend_url('{server}%s' % key, args),
+                           revalidate=True,
+                           request_class=circuit_breaker.WIDGET)
     try:
         xml.attrib
     except AttributeError:
@@ -561,7 +563,7 @@ def extras(plex_id):
     LOG.debug('Showing extras')
     _wait_for_auth()
     app.init(entrypoint=True)
-    xml = PF.GetPlexMetadata(plex_id)
+    xml = PF.GetPlexMetadata(plex_id, revalidate=True)
     try:
         xml[0].attrib
     except (TypeError, IndexError, KeyError):
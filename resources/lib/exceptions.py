@@ -23,6 +23,13 @@ class SubtitleError(Exception):
     pass
 
 
+class StagingConflict(Exception):
+    """
+    Kodi changed its DB in a way that we cannot merge our staging DB into it
+    """
+    pass
+
+
 class ProcessingNotDone(Exception):
     """
     Exception to detect whether we've completed our sync and did not have to
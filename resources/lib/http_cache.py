@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+On-disk cache for PMS answers that carry validators (ETag and/or
+Last-Modified).
+
+PKC's listings run in a fresh plugin process every time Kodi asks for them,
+so they can't rely on any in-memory cache. Instead, the answer is stored in
+addon_data. The next time, the PMS is asked with If-None-Match/
+If-Modified-Since. If nothing changed, the PMS answers with a body-less 304
+and we use the stored body.
+
+Several plugin processes might use the cache at once: answers are written to
+a temporary file first, then renamed. A stored body that can't be parsed
+(anymore) is treated as a cache miss.
+
+Only requests that opt in with downloadUrl(..., revalidate=True) are cached.
+"""
+from logging import getLogger
+from hashlib import sha1
+from threading import Lock
+import json
+import os
+import random
+import tempfile
+
+from . import path_ops, plex_json, utils, variables as v
+
+LOG = getLogger('PLEX.http_cache')
+
+# Max. number of cached answers - the oldest ones are dropped first
+MAX_ENTRIES = 500
+# Prune the cache on every PRUNE_EVERY-th store on average. Picked at random
+# as every plugin process only stores a handful of answers
+PRUNE_EVERY = 20
+STATS_FILE = 'stats.json'
+# Suffix of the files not yet completely written
+TEMP_SUFFIX = '.tmp'
+# Counters kept across plugin processes, see flush_stats(). Approximate, as
+# concurrent processes might overwrite each other's updates
+STATS_KEYS = ('hits', 'misses', 'stored', 'bytes_saved')
+
+_LOCK = Lock()
+# Counters of this Python instance not yet written to STATS_FILE
+_STATS = dict.fromkeys(STATS_KEYS, 0)
+
+
+def _path(filename):
+    return os.path.join(v.HTTP_CACHE_PATH, filename)
+
+
+def key(url, parameters, header_options, token):
+    """
+    Returns the cache key for a GET request. Includes the token as different
+    users get different answers
+    """
+    return sha1(json.dumps((url,
+                            sorted((parameters or {}).items()),
+                            sorted((header_options or {}).items()),
+                            token),
+                           default=str).encode('utf-8')).hexdigest()
+
+
+def load(cache_key):
+    """
+    Returns the tuple (validators, body) stored for cache_key or None.
+    validators is a dict of request headers to revalidate the answer
+    """
+    try:
+        with open(_path(cache_key), 'rb') as f:
+            meta = json.loads(f.readline().decode('utf-8'))
+            body = f.read()
+    except (IOError, OSError, ValueError):
+        return
+    if not _parses(body):
+        LOG.warn('Discarding corrupt cached answer %s', cache_key)
+        _remove(cache_key)
+        return
+    validators = {}
+    if meta.get('etag'):
+        validators['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        validators['If-Modified-Since'] = meta['last_modified']
+    return validators, body
+
+
+def process(cache_key, cached, response):
+    """
+    Call with the PMS' response to a request revalidating cached (or None).
+    Returns a response with the cached body if the PMS answered with 304 Not
+    Modified. Stores a fresh answer with validators
+    """
+    if response.status_code == 304 and cached:
+        # Turn the response into the one the PMS sent the last time
+        response.status_code = 200
+        response._content = cached[1]
+        response._content_consumed = True
+        try:
+            # Prune the least recently used answers first
+            os.utime(_path(cache_key))
+        except OSError:
+            pass
+        _count(hits=1, bytes_saved=len(cached[1]))
+        LOG.debug('Answer not modified, using cached body for %s',
+                  response.url)
+        return response
+    _count(misses=1)
+    if response.status_code == 200:
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if etag or last_modified:
+            _store(cache_key, etag, last_modified, response.content)
+    return response
+
+
+def _parses(body):
+    """
+    Returns True if body is a complete XML or JSON answer
+    """
+    try:
+        if plex_json.is_json(body):
+            json.loads(body)
+        else:
+            utils.etree.fromstring(body)
+    except Exception:
+        return False
+    return True
+
+
+def _remove(cache_key):
+    try:
+        os.remove(_path(cache_key))
+    except OSError:
+        pass
+
+
+def _write(filename, chunks):
+    """
+    Writes the bytes chunks to filename in HTTP_CACHE_PATH. Readers either
+    see the old or the new file, never a partially written one
+    """
+    path_ops.makedirs(v.HTTP_CACHE_PATH, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(suffix=TEMP_SUFFIX,
+                                     dir=v.HTTP_CACHE_PATH)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(temp_path, _path(filename))
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _store(cache_key, etag, last_modified, body):
+    try:
+        _write(cache_key,
+               (json.dumps({'etag': etag,
+                            'last_modified': last_modified}).encode('utf-8'),
+                b'\n',
+                body))
+    except (IOError, OSError) as err:
+        LOG.warn('Could not cache answer: %s', err)
+        return
+    _count(stored=1)
+    if random.random() < 1.0 / PRUNE_EVERY:
+        _prune()
+
+
+def _entries():
+    try:
+        return [x for x in os.scandir(v.HTTP_CACHE_PATH)
+                if x.is_file() and x.name != STATS_FILE and
+                not x.name.endswith(TEMP_SUFFIX)]
+    except (IOError, OSError):
+        return []
+
+
+def _prune():
+    entries = _entries()
+    if len(entries) <= MAX_ENTRIES:
+        return
+    entries.sort(key=lambda x: x.stat().st_mtime)
+    for entry in entries[:len(entries) - MAX_ENTRIES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _read_stats():
+    try:
+        with open(_path(STATS_FILE), 'r') as f:
+            stats = json.load(f)
+    except (IOError, OSError, ValueError):
+        stats = {}
+    return {x: stats.get(x, 0) for x in STATS_KEYS}
+
+
+def _count(**increments):
+    with _LOCK:
+        for name, increment in increments.items():
+            _STATS[name] += increment
+
+
+def flush_stats():
+    """
+    Adds the counters of this Python instance to the ones in STATS_FILE.
+    Call once a plugin process is done
+    """
+    with _LOCK:
+        if not any(_STATS.values()):
+            return
+        stats = _read_stats()
+        for name in STATS_KEYS:
+            stats[name] += _STATS[name]
+            _STATS[name] = 0
+    try:
+        _write(STATS_FILE, (json.dumps(stats).encode('utf-8'), ))
+    except (IOError, OSError):
+        pass
+
+
+def stats():
+    """
+    Returns a dict with the cache's hits (304s), misses, stored answers,
+    bytes we did not need to download, the number of entries and their size
+    on disk
+    """
+    result = _read_stats()
+    with _LOCK:
+        for name in STATS_KEYS:
+            result[name] += _STATS[name]
+    entries = _entries()
+    result['entries'] = len(entries)
+    result['size'] = sum(x.stat().st_size for x in entries)
+    return result
+
+
+def clear():
+    """
+    Deletes all cached answers and the stats. Call whenever the user or
+    the PMS changes
+    """
+    with _LOCK:
+        for name in STATS_KEYS:
+            _STATS[name] = 0
+    if path_ops.exists(v.HTTP_CACHE_PATH):
+        path_ops.rmtree(v.HTTP_CACHE_PATH, ignore_errors=True)
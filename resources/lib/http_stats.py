@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Latency histograms, bandwidth, parse times and status codes of the requests
+DownloadUtils sends to the PMS - per endpoint, e.g. /library/metadata/{id}.
+
+Use this to tune limitindex, the number of download threads or batching.
+dump() writes the numbers to HTTP_STATS_FILE in addon_data, the
+mode=http_stats entry in the PKC settings shows them.
+"""
+from logging import getLogger
+from threading import Lock
+import json
+import re
+import time
+import urllib.parse
+
+from . import path_ops, variables as v
+
+LOG = getLogger('PLEX.http_stats')
+
+# Upper bounds of the latency histogram buckets in milliseconds. The last
+# bucket holds everything slower
+BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Max. number of endpoints we keep track of - paths we can't normalize
+# shouldn't eat up our memory
+MAX_ENDPOINTS = 200
+OTHER_ENDPOINT = '{other}'
+# Path segments identifying a PMS item (or several of them)
+ID_SEGMENT = re.compile(r'^\d+(,\d+)*$')
+IDS_TEMPLATE = {False: '{id}', True: '{ids}'}
+
+_LOCK = Lock()
+_ENDPOINTS = {}
+_STARTED = time.time()
+
+
+def endpoint(url):
+    """
+    Returns the endpoint template for url, e.g. '/library/metadata/{id}'
+    for 'http://pms:32400/library/metadata/123?includeExtras=1'. Batches
+    '/library/metadata/1,2,3' become '/library/metadata/{ids}'
+    """
+    path = urllib.parse.urlsplit(url).path
+    segments = []
+    for segment in path.split('/'):
+        if ID_SEGMENT.match(segment):
+            segment = IDS_TEMPLATE[',' in segment]
+        segments.append(segment)
+    if segments[:3] == ['', 'library', 'parts']:
+        # Files: /library/parts/{id}/{id}/file.mkv - drop the file names
+        segments = segments[:5]
+    return '/'.join(segments) or '/'
+
+
+def _new_entry():
+    return {'requests': 0,
+            'errors': 0,
+            'status': {},
+            'histogram': [0] * (len(BUCKETS_MS) + 1),
+            'time': 0.0,
+            'max_time': 0.0,
+            'bytes': 0,
+            'parsed': 0,
+            'parse_time': 0.0}
+
+
+def _entry(url):
+    key = endpoint(url)
+    try:
+        return _ENDPOINTS[key]
+    except KeyError:
+        if len(_ENDPOINTS) >= MAX_ENDPOINTS:
+            key = OTHER_ENDPOINT
+        return _ENDPOINTS.setdefault(key, _new_entry())
+
+
+def record(url, seconds, status=None, size=0):
+    """
+    Records one request to url that took seconds and received size bytes.
+    Pass status=None if we did not get an answer at all
+    """
+    milliseconds = seconds * 1000
+    bucket = len(BUCKETS_MS)
+    for i, upper in enumerate(BUCKETS_MS):
+        if milliseconds <= upper:
+            bucket = i
+            break
+    with _LOCK:
+        entry = _entry(url)
+        entry['requests'] += 1
+        entry['histogram'][bucket] += 1
+        entry['time'] += seconds
+        entry['max_time'] = max(entry['max_time'], seconds)
+        entry['bytes'] += size
+        if status is None:
+            entry['errors'] += 1
+        else:
+            status = str(status)
+            entry['status'][status] = entry['status'].get(status, 0) + 1
+
+
+def record_parse(url, seconds):
+    """
+    Records the time it took to parse the answer from url
+    """
+    with _LOCK:
+        entry = _entry(url)
+        entry['parsed'] += 1
+        entry['parse_time'] += seconds
+
+
+def _percentile(histogram, fraction):
+    """
+    Returns the upper bound in ms of the bucket holding the fraction-th
+    request, None for the last, unbounded bucket
+    """
+    rank = sum(histogram) * fraction
+    count = 0
+    for i, number in enumerate(histogram):
+        count += number
+        if count >= rank and number:
+            return BUCKETS_MS[i] if i < len(BUCKETS_MS) else None
+
+
+def stats():
+    """
+    Returns a dict {endpoint: stats} with the number of requests, errors
+    (no answer), status codes, the latency histogram (see BUCKETS_MS),
+    average, p50, p95 and max latency in ms, bytes received and the average
+    parse time in ms
+    """
+    with _LOCK:
+        endpoints = {k: dict(v, status=dict(v['status']),
+                             histogram=list(v['histogram']))
+                     for k, v in _ENDPOINTS.items()}
+    for entry in endpoints.values():
+        requests = entry['requests']
+        entry['avg_ms'] = round(entry.pop('time') / requests * 1000, 1) \
+            if requests else 0
+        entry['max_ms'] = round(entry.pop('max_time') * 1000, 1)
+        entry['p50_ms'] = _percentile(entry['histogram'], 0.5)
+        entry['p95_ms'] = _percentile(entry['histogram'], 0.95)
+        parse_time = entry.pop('parse_time')
+        entry['avg_parse_ms'] = round(parse_time / entry['parsed'] * 1000, 1) \
+            if entry['parsed'] else 0
+    return endpoints
+
+
+def dump(**extra):
+    """
+    Writes stats() and the dicts passed as keyword arguments, e.g.
+    circuit breaker stats, to HTTP_STATS_FILE. Returns the data written
+    """
+    data = {'since': int(_STARTED),
+            'dumped': int(time.time()),
+            'buckets_ms': BUCKETS_MS,
+            'endpoints': stats()}
+    data.update(extra)
+    try:
+        path_ops.makedirs(path_ops.path.dirname(v.HTTP_STATS_FILE),
+                          exist_ok=True)
+        with open(v.HTTP_STATS_FILE, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    except (IOError, OSError) as err:
+        LOG.warn('Could not write request stats: %s', err)
+    return data
+
+
+def summary(data):
+    """
+    Returns a human-readable table of the endpoints in data, see dump(), the
+    slowest endpoints (in total) first
+    """
+    lines = ['%-45s %7s %6s %8s %8s %8s %8s %10s %8s'
+             % ('Endpoint', 'Reqs', 'Errors', 'avg ms', 'p50 ms', 'p95 ms',
+                'max ms', 'KiB', 'parse ms')]
+    endpoints = data.get('endpoints', {})
+    for name in sorted(endpoints,
+                       key=lambda x: endpoints[x]['avg_ms'] *
+                       endpoints[x]['requests'],
+                       reverse=True):
+        entry = endpoints[name]
+        lines.append('%-45s %7s %6s %8s %8s %8s %8s %10s %8s'
+                     % (name[:45],
+                        entry['requests'],
+                        entry['errors'],
+                        entry['avg_ms'],
+                        entry['p50_ms'] or '>%s' % BUCKETS_MS[-1],
+                        entry['p95_ms'] or '>%s' % BUCKETS_MS[-1],
+                        entry['max_ms'],
+                        entry['bytes'] // 1024,
+                        entry['avg_parse_ms']))
+        lines.append('    status codes: %s' % ', '.join(
+            '%s: %s' % x for x in sorted(entry['status'].items())))
+    for key in sorted(data):
+        if key not in ('endpoints', 'buckets_ms', 'since', 'dumped'):
+            lines.append('')
+            lines.append('%s: %s' % (key, json.dumps(data[key],
+                                                      sort_keys=True)))
+    return '\n'.join(lines)
@@ -4,7 +4,8 @@ from logging import getLogger
 from ntpath import dirname
 
 from ..plex_db import PlexDB, PLEXDB_LOCK
-from ..kodi_db import KodiVideoDB, KODIDB_LOCK
+from ..kodi_db import KodiVideoDB, KODIDB_LOCK, staging
+from ..exceptions import StagingConflict
 from .. import db, timing, app
 
 LOG = getLogger('PLEX.itemtypes.common')
@@ -36,10 +37,20 @@ class ItemBase(object):
 
     Input:
         kodiType:       optional argument; e.g. 'video' or 'music'
+        bulk:           True to open plex.db and the staging DBs for
+                        bulk-loading, see db.connect. Kodi's live DBs are
+                        always opened with the usual, safe settings
+        staged:         True to write to the staging DB if kodi_db.staging
+                        is active. Changes are merged into Kodi's DB on every
+                        commit
     """
-    def __init__(self, last_sync, plexdb=None, kodidb=None, lock=True):
+    def __init__(self, last_sync, plexdb=None, kodidb=None, lock=True,
+                 bulk=False, staged=False):
         self.last_sync = last_sync
         self.lock = lock
+        self.bulk = bulk
+        self.staged = staged
+        self.staging = None
         self.plexdb = plexdb
         self.kodidb = kodidb
         self.plexconn = plexdb.plexconn if plexdb else None
@@ -56,10 +67,11 @@ class ItemBase(object):
         if self.lock:
             PLEXDB_LOCK.acquire()
             KODIDB_LOCK.acquire()
-        self.plexconn = db.connect('plex')
+        self.plexconn = db.connect('plex', bulk=self.bulk)
         self.plexcursor = self.plexconn.cursor()
-        self.kodiconn = db.connect('video')
+        self.kodiconn = self._connect_kodi('video')
         self.kodicursor = self.kodiconn.cursor()
+        # Kodi's live texture DB - never with synchronous=OFF
         self.artconn = db.connect('texture')
         self.artcursor = self.artconn.cursor()
         self.plexdb = PlexDB(plexconn=self.plexconn, lock=False)
@@ -77,6 +89,8 @@ class ItemBase(object):
             if exc_type:
                 # re-raise any exception
                 return False
+            if self.staging:
+                self._merge_staging()
             self.plexconn.commit()
             self.kodiconn.commit()
             if self.artconn:
@@ -91,7 +105,44 @@ class ItemBase(object):
                 PLEXDB_LOCK.release()
                 KODIDB_LOCK.release()
 
+    def _connect_kodi(self, media_type):
+        """
+        Returns a connection to Kodi's DB for media_type ('video' or 'music')
+        or to its staging DB. Only our private staging DB is opened for
+        bulk-loading - Kodi's live DB is in use by Kodi
+        """
+        self.staging = staging.get(media_type) if self.staged else None
+        if self.staging:
+            return self.staging.connect(self.bulk)
+        return db.connect(media_type)
+
+    def _merge_staging(self):
+        """
+        Merges everything we wrote to the staging DB into Kodi's DB. Raises
+        StagingConflict if that failed - plex.db changes are then discarded,
+        too, so the caller can simply write the items again
+        """
+        self.kodiconn.commit()
+        try:
+            self.staging.merge()
+        except StagingConflict:
+            self.plexconn.rollback()
+            self.plexconn.execute('BEGIN')
+            raise
+        finally:
+            if self.staging.stale:
+                self.kodiconn.close()
+                self.kodiconn = self.staging.connect(self.bulk)
+                self.kodicursor = self.kodiconn.cursor()
+                self.kodidb = self.kodidb.__class__(texture_db=True,
+                                                    kodiconn=self.kodiconn,
+                                                    artconn=self.artconn,
+                                                    lock=False)
+
     def commit(self):
+        if self.staging:
+            # Kodi's DB first - plex.db must not reference missing items
+            self._merge_staging()
         self.plexconn.commit()
         self.plexconn.execute('BEGIN')
         self.kodiconn.commit()
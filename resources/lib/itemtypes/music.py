@@ -19,10 +19,11 @@ class MusicMixin(object):
         if self.lock:
             PLEXDB_LOCK.acquire()
             KODIDB_LOCK.acquire()
-        self.plexconn = db.connect('plex')
+        self.plexconn = db.connect('plex', bulk=self.bulk)
         self.plexcursor = self.plexconn.cursor()
-        self.kodiconn = db.connect('music')
+        self.kodiconn = self._connect_kodi('music')
         self.kodicursor = self.kodiconn.cursor()
+        # Kodi's live texture DB - never with synchronous=OFF
         self.artconn = db.connect('texture')
         self.artcursor = self.artconn.cursor()
         self.plexdb = PlexDB(plexconn=self.plexconn, lock=False)
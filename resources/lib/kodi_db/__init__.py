@@ -6,6 +6,7 @@ from .common import KODIDB_LOCK
 from .video import KodiVideoDB
 from .music import KodiMusicDB
 from .texture import KodiTextureDB
+from . import staging
 
 from .. import path_ops, utils, variables as v
 
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Private staging copies of Kodi's video and music DBs for library sync.
+
+Sync writes every item into the staging DB instead of Kodi's live DB. After
+each batch, the batch is merged into the live DB via ATTACH and
+INSERT ... SELECT in one single, short transaction. Kodi's own readers thus
+only compete with us for the DB lock while the merge is running, not while
+we're processing item after item.
+
+Triggers within the staging DB record every row we insert, update or delete,
+together with its content before we touched it for the first time since the
+last merge. Only these rows are merged. Before merging, every one of them is
+compared with the live DB: if Kodi (or PKC writing to the live DB directly,
+e.g. playstate updates) changed, deleted or added such a row in the meantime,
+we discard the batch instead of reverting Kodi's change, and start over with
+a fresh snapshot of the live DB.
+"""
+from logging import getLogger
+import sqlite3
+
+from .common import UNTOUCHED_TABLES
+from .. import db, path_ops, variables as v
+from ..exceptions import StagingConflict
+
+LOG = getLogger('PLEX.kodi_db.staging')
+
+# {'video': StagingDB, 'music': StagingDB} while staging is active
+STAGED = {}
+
+
+def start(media_types):
+    """
+    Creates staging DBs for media_types, e.g. ('video', 'music'). Returns
+    False and does not stage anything if that did not work out
+    """
+    try:
+        for media_type in media_types:
+            STAGED[media_type] = StagingDB(media_type)
+    except (sqlite3.Error, OSError) as err:
+        LOG.error('Could not set up the staging DBs, writing to the Kodi DBs '
+                  'directly: %s', err)
+        stop()
+        return False
+    return True
+
+
+def stop():
+    """
+    Stops staging and deletes all staging DBs. Everything has been merged
+    already
+    """
+    while STAGED:
+        STAGED.popitem()[1].delete()
+
+
+def get(media_type):
+    """
+    Returns the StagingDB for media_type or None if we're not staging
+    """
+    return STAGED.get(media_type)
+
+
+class StagingDB(object):
+    """
+    The staging DB for one of Kodi's DBs, media_type 'video' or 'music'
+    """
+    def __init__(self, media_type):
+        self.media_type = media_type
+        self.db_kind = '%s-staging' % media_type
+        self.path = v.DB_VIDEO_STAGING_PATH if media_type == 'video' \
+            else v.DB_MUSIC_STAGING_PATH
+        self.live_path = v.DB_VIDEO_PATH if media_type == 'video' \
+            else v.DB_MUSIC_PATH
+        # {table: 'column list' to copy, including the rowid}
+        self.columns = {}
+        # {table: [column names, including the rowid]}
+        self.column_names = {}
+        # {table: highest rowid of the table after the last merge}
+        self.watermarks = {}
+        # Set if the staging DB no longer mirrors the live DB
+        self.stale = True
+        self.create()
+
+    def delete(self):
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            if path_ops.exists(path):
+                path_ops.remove(path)
+
+    def create(self):
+        """
+        (Re-)creates the staging DB as a snapshot of Kodi's live DB and sets
+        up the triggers recording our changes
+        """
+        self.delete()
+        live = sqlite3.connect(self.live_path,
+                               timeout=db.DB_CONNECTION_TIMEOUT)
+        staging = sqlite3.connect(self.path)
+        try:
+            live.backup(staging)
+        finally:
+            live.close()
+            staging.close()
+        conn = db.connect(self.db_kind)
+        try:
+            conn.execute('''
+                CREATE TABLE staging_changes(
+                    tbl TEXT,
+                    row INTEGER,
+                    deleted INTEGER,
+                    before TEXT,
+                    PRIMARY KEY (tbl, row))
+            ''')
+            tables = [x[0] for x in conn.execute('''
+                SELECT name FROM sqlite_master
+                WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+                AND name != 'staging_changes'
+            ''') if x[0] not in UNTOUCHED_TABLES]
+            self.columns = {}
+            self.column_names = {}
+            self.watermarks = {}
+            for table in tables:
+                self.column_names[table] = self._column_names(conn, table)
+                self.columns[table] = ', '.join(self.column_names[table])
+                self.watermarks[table] = self._max_rowid(conn, 'main', table)
+                self._create_triggers(conn, table, self.column_names[table])
+            conn.commit()
+        finally:
+            conn.close()
+        self.stale = False
+        LOG.debug('Created staging DB %s with %s tables',
+                  self.path, len(self.columns))
+
+    @staticmethod
+    def _column_names(conn, table):
+        info = conn.execute('PRAGMA table_info("%s")' % table).fetchall()
+        columns = ['"%s"' % x[1] for x in info]
+        pks = [x for x in info if x[5]]
+        if len(pks) != 1 or pks[0][2].upper() != 'INTEGER':
+            # The rowid is not aliased by an INTEGER PRIMARY KEY column
+            columns.insert(0, 'rowid')
+        return columns
+
+    @staticmethod
+    def _content(alias, columns):
+        """
+        SQL expression turning the row alias into a string that is identical
+        for two rows if and only if all their columns are
+        """
+        return " || '|' || ".join('quote(%s.%s)' % (alias, x) for x in columns)
+
+    @staticmethod
+    def _max_rowid(conn, schema, table):
+        return conn.execute('SELECT MAX(rowid) FROM %s."%s"'
+                            % (schema, table)).fetchone()[0] or 0
+
+    @classmethod
+    def _create_triggers(cls, conn, table, columns):
+        # INSERT OR IGNORE keeps the row's content from before our first
+        # change since the last merge. NULL: the row did not exist
+        conn.execute('''
+            CREATE TRIGGER "staging_insert_{0}" AFTER INSERT ON "{0}"
+            BEGIN
+                INSERT OR IGNORE INTO staging_changes
+                VALUES ('{0}', NEW.rowid, 0, NULL);
+                UPDATE staging_changes SET deleted = 0
+                WHERE tbl = '{0}' AND row = NEW.rowid;
+            END
+        '''.format(table))
+        conn.execute('''
+            CREATE TRIGGER "staging_update_{0}" AFTER UPDATE ON "{0}"
+            BEGIN
+                INSERT OR IGNORE INTO staging_changes
+                VALUES ('{0}', OLD.rowid, 0, {1});
+                UPDATE staging_changes SET deleted = 1
+                WHERE tbl = '{0}' AND row = OLD.rowid
+                AND OLD.rowid != NEW.rowid;
+                INSERT OR IGNORE INTO staging_changes
+                VALUES ('{0}', NEW.rowid, 0, NULL);
+                UPDATE staging_changes SET deleted = 0
+                WHERE tbl = '{0}' AND row = NEW.rowid;
+            END
+        '''.format(table, cls._content('OLD', columns)))
+        conn.execute('''
+            CREATE TRIGGER "staging_delete_{0}" AFTER DELETE ON "{0}"
+            BEGIN
+                INSERT OR IGNORE INTO staging_changes
+                VALUES ('{0}', OLD.rowid, 1, {1});
+                UPDATE staging_changes SET deleted = 1
+                WHERE tbl = '{0}' AND row = OLD.rowid;
+            END
+        '''.format(table, cls._content('OLD', columns)))
+
+    def _conflicts(self, live, table):
+        """
+        Returns the number of rows of table we changed in the staging DB that
+        do not look like they did in our snapshot anymore in the live DB
+        """
+        return live.execute('''
+            SELECT COUNT(*) FROM staging.staging_changes AS c
+            LEFT JOIN main."{0}" AS l ON l.rowid = c.row
+            WHERE c.tbl = ?
+            AND (CASE WHEN l.rowid IS NULL THEN NULL ELSE {1} END)
+                IS NOT c.before
+        '''.format(table, self._content('l', self.column_names[table])),
+            (table, )).fetchone()[0]
+
+    def connect(self, bulk=False):
+        """
+        Returns a connection to the staging DB, see db.connect. Re-creates
+        the staging DB first if needed
+        """
+        if self.stale:
+            self.create()
+        return db.connect(self.db_kind, bulk=bulk)
+
+    def merge(self):
+        """
+        Merges everything committed to the staging DB since the last merge
+        into Kodi's live DB, in one transaction. Raises StagingConflict
+        (without changing the live DB) if any of the rows we changed has been
+        changed in the live DB since our snapshot
+        """
+        live = db.connect(self.media_type)
+        try:
+            # Can't ATTACH within a transaction
+            live.commit()
+            live.execute('ATTACH DATABASE ? AS staging', (self.path, ))
+            live.execute('BEGIN IMMEDIATE')
+            changed = [x[0] for x in live.execute(
+                'SELECT DISTINCT tbl FROM staging.staging_changes')]
+            if not changed:
+                live.commit()
+                return
+            conflicts = {}
+            for table in changed:
+                count = self._conflicts(live, table)
+                if count:
+                    conflicts[table] = count
+            if conflicts:
+                live.rollback()
+                self.stale = True
+                raise StagingConflict('Kodi changed rows we changed, too: %s'
+                                      % conflicts)
+            diverged = [x for x in self.columns
+                        if self._max_rowid(live, 'main', x) > self.watermarks[x]]
+            # Deletions first - a row might have been deleted and re-added
+            for table in changed:
+                live.execute('''
+                    DELETE FROM main."%s" WHERE rowid IN (
+                        SELECT row FROM staging.staging_changes
+                        WHERE tbl = ? AND deleted = 1)
+                ''' % table, (table, ))
+            for table in changed:
+                live.execute('''
+                    INSERT OR REPLACE INTO main."{0}" ({1})
+                    SELECT {1} FROM staging."{0}" WHERE rowid IN (
+                        SELECT row FROM staging.staging_changes
+                        WHERE tbl = ? AND deleted = 0)
+                '''.format(table, self.columns[table]), (table, ))
+                self.watermarks[table] = self._max_rowid(live, 'main', table)
+            live.execute('DELETE FROM staging.staging_changes')
+            live.commit()
+        except sqlite3.Error:
+            live.rollback()
+            self.stale = True
+            raise
+        finally:
+            live.close()
+        if diverged:
+            # Kodi added rows in the meantime. Refresh our snapshot so that
+            # our next inserts don't use the same rowids
+            LOG.info('Kodi added rows to tables %s, refreshing staging DB',
+                     diverged)
+            self.stale = True
+        LOG.debug('Merged changes to %s tables into the Kodi %s DB',
+                  len(changed), self.media_type)
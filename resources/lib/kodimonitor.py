@@ -55,6 +55,7 @@ class KodiMonitor(xbmc.Monitor):
         Monitor the PKC settings for changes made by the user
         """
         LOG.debug('PKC settings change detected')
+        utils.refresh_settings()
 
     def onNotification(self, sender, method, data):
         """
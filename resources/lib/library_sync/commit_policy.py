@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Decides when library sync commits its write transaction. A fixed number of
+items is either way too much (episodes with lots of people and streams) or
+way too little (playstates). We commit as soon as ANY of these is reached:
+    - a maximum number of items
+    - a maximum number of rows written to the DBs
+    - a maximum duration of the transaction
+Independently, the DB context should be left once in a while to release
+PKC's own DB locks, see lock_expired().
+
+How long each commit took is recorded and logged.
+"""
+from logging import getLogger
+from time import time
+
+LOG = getLogger('PLEX.sync.commit_policy')
+
+
+class CommitPolicy(object):
+    """
+    Call start(context) after entering a DB context, then items_done(n)
+    after processing items and commit(context) if should_commit(context)
+    returns True. Leave and re-enter the DB context if lock_expired()
+    """
+    def __init__(self, max_items, max_rows, max_seconds,
+                 max_lock_seconds=None):
+        self.max_items = max_items
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.max_lock_seconds = max_lock_seconds
+        self._items = 0
+        self._rows_start = 0
+        self._transaction_start = 0.0
+        self._lock_start = 0.0
+        # Commit statistics
+        self.commits = 0
+        self.last_duration = 0.0
+        self.longest = 0.0
+        self.total_duration = 0.0
+
+    @staticmethod
+    def _rows(context):
+        rows = context.plexconn.total_changes + context.kodiconn.total_changes
+        if context.artconn:
+            rows += context.artconn.total_changes
+        return rows
+
+    def start(self, context):
+        """
+        Call right after entering a DB context
+        """
+        self._items = 0
+        self._rows_start = self._rows(context)
+        self._transaction_start = self._lock_start = time()
+
+    def items_done(self, items=1):
+        self._items += items
+
+    def should_commit(self, context):
+        if self._items >= self.max_items:
+            return True
+        elif time() - self._transaction_start >= self.max_seconds:
+            return True
+        return self._rows(context) - self._rows_start >= self.max_rows
+
+    def lock_expired(self):
+        """
+        True if we've been holding PKC's DB locks for too long - leave the
+        DB context to let other threads in. Always False if max_lock_seconds
+        is None
+        """
+        return (self.max_lock_seconds is not None and
+                time() - self._lock_start >= self.max_lock_seconds)
+
+    def commit(self, context):
+        rows = self._rows(context) - self._rows_start
+        start = time()
+        context.commit()
+        now = time()
+        self.last_duration = now - start
+        self.longest = max(self.longest, self.last_duration)
+        self.total_duration += self.last_duration
+        self.commits += 1
+        LOG.debug('Committed %s items and %s rows after %.2fs, commit took '
+                  '%.3fs', self._items, rows, start - self._transaction_start,
+                  self.last_duration)
+        self._items = 0
+        self._rows_start = self._rows(context)
+        self._transaction_start = now
+
+    def log_summary(self):
+        if self.commits:
+            LOG.info('%s commits took %.2fs in total, %.3fs on average and '
+                     '%.3fs at most', self.commits, self.total_duration,
+                     self.total_duration / self.commits, self.longest)
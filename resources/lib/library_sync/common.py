@@ -1,15 +1,32 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from logging import getLogger
+from zlib import crc32
+
 import xbmc
 
 from .. import utils, app, variables as v
+from .. import plex_functions as PF
 
 LOG = getLogger('PLEX.sync')
 
 PLAYLIST_SYNC_ENABLED = (v.DEVICE != 'Microsoft UWP' and
                          utils.settings('enablePlaylistSync') == 'true')
 
+# Phases of a full sync recorded in plex.db's sync_checkpoints, in order
+CHECKPOINT_NEW = 'new'
+CHECKPOINT_PLAYSTATE = 'playstate'
+CHECKPOINT_DONE = 'done'
+CHECKPOINT_PHASES = (CHECKPOINT_NEW, CHECKPOINT_PLAYSTATE, CHECKPOINT_DONE)
+
+# The attributes each full sync phase needs from the PMS section listings:
+# the new/changed items pass only compares checksums, the playstate pass only
+# reads the userdata
+PHASE_FIELDS = {
+    CHECKPOINT_NEW: PF.SYNC_FIELDS,
+    CHECKPOINT_PLAYSTATE: PF.USERDATA_FIELDS,
+}
+
 
 class LibrarySyncMixin(object):
     def suspend(self, block=False, timeout=None):
@@ -52,6 +69,34 @@ def update_kodi_library(video=True, music=True):
         xbmc.executebuiltin('UpdateLibrary(music)')
 
 
+def phase_fields(phase):
+    """
+    Returns the includeFields projection for the PMS section listings of the
+    full sync phase, see PHASE_FIELDS. Returns PF.DETAIL_FIELDS (everything)
+    if the user disabled field filtering
+    """
+    if utils.settings('enableReduceBandwidth') != 'true':
+        return PF.DETAIL_FIELDS
+    elif phase == CHECKPOINT_PLAYSTATE and app.SYNC.indicate_media_versions:
+        # Media versions are counted using the Media children
+        return PF.DETAIL_FIELDS
+    return PHASE_FIELDS[phase]
+
+
+def userdata_fingerprint(xml):
+    """
+    Returns a compact and stable [int] fingerprint of the PMS userdata of xml:
+    viewCount, viewOffset, lastViewedAt, userRating and duration (Kodi stores
+    the runtime along with the resume point). Will change if any of these
+    change
+    """
+    return crc32(('%s|%s|%s|%s|%s' % (xml.get('viewCount'),
+                                      xml.get('viewOffset'),
+                                      xml.get('lastViewedAt'),
+                                      xml.get('userRating'),
+                                      xml.get('duration'))).encode('utf-8'))
+
+
 def tag_last(iterable):
     """
     Given some iterable, returns (last, item), where last is only True if you
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+AIMD (additive increase, multiplicative decrease) controller for the number of
+GetMetadataThreads that are allowed to download from the PMS simultaneously.
+
+Every GetMetadataThread asks for a permit before talking to the PMS and
+reports the latency and outcome of its request afterwards. Once per
+evaluation window the controller
+    - halves the number of permits if the PMS returned errors or got a lot
+      slower than the best latency we have seen so far
+    - keeps the number of permits if our writer thread cannot keep up anyway
+      (the processing_queue is almost full)
+    - adds one permit otherwise
+"""
+from logging import getLogger
+from threading import Condition
+from time import time
+
+LOG = getLogger('PLEX.sync.concurrency')
+
+# Number of concurrent downloads to start out with
+INITIAL_LIMIT = 2
+# Evaluate after this many requests or this many seconds, whatever comes first
+WINDOW_REQUESTS = 10
+WINDOW_SECONDS = 5.0
+# Back off if more than this share of requests failed
+MAX_ERROR_RATE = 0.1
+# Back off if the latency per item exceeds our baseline by this factor
+MAX_LATENCY_FACTOR = 2.5
+# Let the baseline latency creep up by this factor per window so a single
+# lucky measurement does not throttle us forever
+BASELINE_DRIFT = 1.1
+# Don't add downloaders if the processing_queue is filled beyond this share
+QUEUE_HIGH_WATERMARK = 0.8
+
+
+class AdaptiveConcurrency(object):
+    """
+    Thread-safe. Use acquire() before and release() after every download
+    """
+    def __init__(self, maximum, processing_queue, minimum=1):
+        self.maximum = max(minimum, maximum)
+        self.minimum = minimum
+        self.limit = max(minimum, min(self.maximum, INITIAL_LIMIT))
+        self.active = 0
+        self._processing_queue = processing_queue
+        self._condition = Condition()
+        # Best average latency per item [seconds] we've seen so far
+        self._baseline = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time()
+        self._requests = 0
+        self._errors = 0
+        self._items = 0
+        self._latency = 0.0
+
+    def acquire(self, should_cancel):
+        """
+        Blocks until this thread may download. Returns False if should_cancel
+        [callable] returned True while waiting
+        """
+        with self._condition:
+            while self.active >= self.limit:
+                if should_cancel():
+                    return False
+                self._condition.wait(0.5)
+            self.active += 1
+            return True
+
+    def release(self, latency, items=1, error=False):
+        """
+        Report a finished download that took latency [seconds] for items
+        [int] items. Set error=True if the PMS did not deliver
+        """
+        with self._condition:
+            self.active -= 1
+            self._requests += 1
+            self._items += max(1, items)
+            self._latency += latency
+            if error:
+                self._errors += 1
+            if (self._requests >= WINDOW_REQUESTS or
+                    time() - self._window_start >= WINDOW_SECONDS):
+                self._adjust()
+            self._condition.notify_all()
+
+    def can_back_off(self):
+        """
+        Returns True if we could still reduce the number of downloaders, e.g.
+        instead of giving up after the PMS told us that it's under strain
+        """
+        with self._condition:
+            return self.limit > self.minimum
+
+    def _adjust(self):
+        latency = self._latency / self._items
+        error_rate = float(self._errors) / self._requests
+        depth = self._processing_queue.qsize()
+        maxsize = self._processing_queue.maxsize
+        old_limit = self.limit
+        if error_rate > MAX_ERROR_RATE:
+            self.limit = max(self.minimum, self.limit // 2)
+            reason = 'PMS errors'
+        elif self._baseline and latency > self._baseline * MAX_LATENCY_FACTOR:
+            self.limit = max(self.minimum, self.limit // 2)
+            reason = 'PMS latency'
+        elif maxsize and depth >= maxsize * QUEUE_HIGH_WATERMARK:
+            reason = 'writer busy'
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+            reason = 'PMS keeps up'
+        if not self._errors:
+            self._baseline = latency if self._baseline is None \
+                else min(latency, self._baseline * BASELINE_DRIFT)
+        LOG.debug('Downloaders: %s -> %s (%s). Latency %.3fs/item, baseline '
+                  '%.3fs/item, errors %s/%s, processing queue %s/%s',
+                  old_limit, self.limit, reason, latency, self._baseline or 0,
+                  self._errors, self._requests, depth, maxsize)
+        if self.limit != old_limit:
+            LOG.info('Now using %s simultaneous metadata downloads (%s)',
+                     self.limit, reason)
+        self._reset_window()
@@ -24,6 +24,8 @@ class FillMetadataQueue(common.LibrarySyncMixin,
         self.section_queue = section_queue
         self.get_metadata_queue = get_metadata_queue
         self.processing_queue = processing_queue
+        # plex_ids already queued by a priority section - skip them later on
+        self.prioritized = set()
         super(FillMetadataQueue, self).__init__()
 
     def _process_section(self, section):
@@ -33,32 +35,53 @@ class FillMetadataQueue(common.LibrarySyncMixin,
                   section, section.number_of_items)
         count = 0
         do_process_section = False
-        with PlexDB(lock=False, copy=True) as plexdb:
-            for xml in section.iterator:
-                if self.should_cancel():
-                    break
-                plex_id = int(xml.get('ratingKey'))
-                checksum = int('{}{}'.format(
-                    plex_id,
-                    abs(int(xml.get('updatedAt',
-                            xml.get('addedAt', '1541572987'))))))
-                if (not self.repair and
-                        plexdb.checksum(plex_id, section.plex_type) == checksum):
-                    continue
-                if not do_process_section:
-                    do_process_section = True
-                    self.processing_queue.add_section(section)
-                    LOG.debug('Put section in processing queue: %s', section)
-                try:
-                    self.get_metadata_queue.put((count, plex_id, section),
-                                                timeout=QUEUE_TIMEOUT)
-                except Full:
-                    LOG.error('Putting %s in get_metadata_queue timed out - '
-                              'aborting sync now', plex_id)
-                    section.sync_successful = False
-                    break
-                else:
-                    count += 1
+        if self.repair:
+            checksums = {}
+        elif section.priority:
+            # Only a handful of items - look them up one by one
+            with PlexDB(lock=False, copy=True) as plexdb:
+                checksums = {
+                    plex_id: plexdb.checksum(plex_id, section.plex_type)
+                    for plex_id in (int(x.get('ratingKey'))
+                                    for x in section.iterator)}
+        else:
+            # Load all checksums of this section at once - way faster than
+            # one SQL query per PMS item
+            with PlexDB(lock=False, copy=True) as plexdb:
+                checksums = dict(plexdb.checksums_by_section(section.section_id,
+                                                             section.plex_type))
+        for xml in section.iterator:
+            if self.should_cancel():
+                break
+            plex_id = int(xml.get('ratingKey'))
+            if plex_id <= section.resume_after:
+                # An interrupted sync already took care of this item
+                continue
+            if plex_id in self.prioritized:
+                continue
+            checksum = int('{}{}'.format(
+                plex_id,
+                abs(int(xml.get('updatedAt',
+                        xml.get('addedAt', '1541572987'))))))
+            if checksums.get(plex_id) == checksum:
+                continue
+            if not do_process_section:
+                do_process_section = True
+                self.processing_queue.add_section(section)
+                LOG.debug('Put section in processing queue: %s', section)
+            try:
+                self.get_metadata_queue.put((count, plex_id, section),
+                                            timeout=QUEUE_TIMEOUT)
+            except Full:
+                LOG.error('Putting %s in get_metadata_queue timed out - '
+                          'aborting sync now', plex_id)
+                section.sync_successful = False
+                break
+            else:
+                count += 1
+                if section.priority:
+                    self.prioritized.add(plex_id)
+        del checksums
         # We might have received LESS items from the PMS than anticipated.
         # Ensures that our queues finish
         self.processing_queue.change_section_number_of_items(section,
@@ -1,16 +1,26 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from logging import getLogger
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import queue
 
 import xbmcgui
 
 from .get_metadata import GetMetadataThread
+from .concurrency import AdaptiveConcurrency
 from .fill_metadata_queue import FillMetadataQueue
 from .process_metadata import ProcessMetadataThread
+from .commit_policy import CommitPolicy
 from . import common, sections
+from ..plex_db import PlexDB, drop_secondary_indexes, create_secondary_indexes
+from ..kodi_db import staging
+from ..downloadutils import DownloadUtils as DU
 from .. import utils, timing, backgroundthread as bg, variables as v, app
-from .. import plex_functions as PF, itemtypes, path_ops
+from .. import plex_functions as PF, itemtypes, path_ops, circuit_breaker
+from .. import rate_limiter
 
 if common.PLAYLIST_SYNC_ENABLED:
     from .. import playlists
@@ -18,15 +28,27 @@ if common.PLAYLIST_SYNC_ENABLED:
 
 LOG = getLogger('PLEX.sync.full_sync')
 DELETION_BATCH_SIZE = 250
+# Commit the playstate pass after this many items, rows or seconds
 PLAYSTATE_BATCH_SIZE = 5000
+PLAYSTATE_MAX_ROWS = 20000
+PLAYSTATE_MAX_SECONDS = 2.0
 
 # Max. number of plex_ids held in memory for later processing
 BACKLOG_QUEUE_SIZE = 10000
 # Max number of xmls held in memory
 XML_QUEUE_SIZE = 500
+# Number of section iterators we build and start prefetching simultaneously
+PREFETCH_SECTIONS = 4
 # Safety margin to filter PMS items - how many seconds to look into the past?
 UPDATED_AT_SAFETY = 60 * 5
-LAST_VIEWED_AT_SAFETY = 60 * 5
+# Home hubs whose items we sync before anything else during long syncs
+PRIORITY_HUBS = ('/hubs/home/continueWatching',
+                 '/hubs/home/recentlyAdded?type=1',
+                 '/hubs/home/recentlyAdded?type=2')
+# Max. number of items per priority hub
+PRIORITY_HUB_SIZE = 50
+# Only these plex types are synced ahead (episodes pull in show and season)
+PRIORITY_TYPES = (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_EPISODE)
 
 
 class FullSync(common.LibrarySyncMixin, bg.KillableThread):
@@ -46,6 +68,20 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
         else:
             self.dialog = None
         self.current_time = timing.plex_now()
+        with PlexDB() as plexdb:
+            if repair:
+                plexdb.clear_sync_checkpoints()
+            # {(section_id, plex_type): (phase, position, sync_started)}
+            self.checkpoints = plexdb.sync_checkpoints()
+        if self.checkpoints:
+            # Resume the interrupted sync. Stick to its timestamp so the items
+            # it already marked with last_sync are not deleted later on
+            self.current_time = min(x[2] for x in self.checkpoints.values())
+            LOG.info('Resuming the full sync started at %s for %s sections',
+                     self.current_time, len(self.checkpoints))
+        # {(section_id, plex_type): (number of items, max. updatedAt)} as
+        # reported by the PMS at the start of this sync
+        self.pms_digests = {}
         self.last_section = sections.Section()
         self.install_sync_done = utils.settings('SyncInstallRunDone') == 'true'
         super(FullSync, self).__init__()
@@ -77,7 +113,8 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
         path_ops.copyfile(v.DB_PLEX_PATH, v.DB_PLEX_COPY_PATH)
 
     @utils.log_time
-    def process_new_and_changed_items(self, section_queue, processing_queue):
+    def process_new_and_changed_items(self, section_queue, processing_queue,
+                                      staged=False):
         LOG.debug('Start working')
         get_metadata_queue = queue.Queue(maxsize=BACKLOG_QUEUE_SIZE)
         scanner_thread = FillMetadataQueue(self.repair,
@@ -85,114 +122,340 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
                                            get_metadata_queue,
                                            processing_queue)
         scanner_thread.start()
+        # syncThreadNumber is the upper limit - the number of threads actually
+        # downloading adapts to how well the PMS copes
+        concurrency = AdaptiveConcurrency(int(utils.settings('syncThreadNumber')),
+                                          processing_queue)
         metadata_threads = [
-            GetMetadataThread(get_metadata_queue, processing_queue)
-            for _ in range(int(utils.settings('syncThreadNumber')))
+            GetMetadataThread(get_metadata_queue, processing_queue, concurrency)
+            for _ in range(concurrency.maximum)
         ]
         for t in metadata_threads:
             t.start()
-        process_thread = ProcessMetadataThread(self.current_time,
-                                               processing_queue,
-                                               self.update_progressbar)
+        process_thread = ProcessMetadataThread(
+            self.current_time,
+            processing_queue,
+            self.update_progressbar,
+            bulk=not self.install_sync_done,
+            staged=staged)
         process_thread.start()
         LOG.debug('Waiting for scanner thread to finish up')
         scanner_thread.join()
         LOG.debug('Waiting for metadata download threads to finish up')
         for t in metadata_threads:
             t.join()
-        LOG.debug('Download metadata threads finished')
+        LOG.debug('Download metadata threads finished. Ended up with %s '
+                  'simultaneous downloads', concurrency.limit)
         process_thread.join()
         self.successful = process_thread.successful
         LOG.debug('threads finished work. successful: %s', self.successful)
 
     @utils.log_time
     def processing_loop_playstates(self, section_queue):
+        self.playstate_commit_policy = CommitPolicy(PLAYSTATE_BATCH_SIZE,
+                                                    PLAYSTATE_MAX_ROWS,
+                                                    PLAYSTATE_MAX_SECONDS)
         while not self.should_cancel():
             section = section_queue.get()
             section_queue.task_done()
             if section is None:
                 break
             self.playstate_per_section(section)
+        self.playstate_commit_policy.log_summary()
 
     def playstate_per_section(self, section):
         LOG.debug('Processing %s playstates for library section %s',
                   section.number_of_items, section)
+        # plex_ids we encountered on the PMS; their last_sync is set in bulk
+        seen = array('q')
+        # (plex_id, fingerprint) for items whose userdata we just wrote
+        changed = []
+        # Items the PMS knows but we somehow did not sync yet
+        missing = []
+        updated = 0
         try:
             with section.context(self.current_time) as context:
+                policy = self.playstate_commit_policy
+                policy.start(context)
+                if section.resume_after:
+                    LOG.info('Resuming playstate sync after plex_id %s for '
+                             '%s', section.resume_after, section)
+                if self.repair:
+                    fingerprints = {}
+                else:
+                    fingerprints = dict(context.plexdb.userdata_fingerprints(
+                        section.section_id, section.plex_type))
                 for xml in section.iterator:
                     section.count += 1
-                    if not context.update_userdata(xml, section.plex_type):
-                        # Somehow did not sync this item yet
-                        context.add_update(xml,
-                                           section_name=section.name,
-                                           section_id=section.section_id)
-                    context.plexdb.update_last_sync(int(xml.attrib['ratingKey']),
-                                                    section.plex_type,
-                                                    self.current_time)
+                    plex_id = int(xml.attrib['ratingKey'])
+                    if plex_id <= section.resume_after:
+                        continue
+                    fingerprint = common.userdata_fingerprint(xml)
+                    if fingerprints.get(plex_id) != fingerprint:
+                        if context.update_userdata(xml, section.plex_type):
+                            changed.append((plex_id, fingerprint))
+                            updated += 1
+                        else:
+                            missing.append(plex_id)
+                    seen.append(plex_id)
                     self.update_progressbar(section, '', section.count - 1)
-                    if section.count % PLAYSTATE_BATCH_SIZE == 0:
-                        context.commit()
+                    policy.items_done()
+                    if policy.should_commit(context):
+                        self._flush_playstates(context, section, seen, changed)
+                        seen = array('q')
+                        changed = []
+                        policy.commit(context)
+                self._flush_playstates(context, section, seen, changed)
+                del fingerprints
+                for plex_id in missing:
+                    if self.should_cancel():
+                        break
+                    # We only downloaded the userdata - get everything else
+                    xml = PF.GetPlexMetadata(plex_id, use_cache=False)
+                    try:
+                        xml[0].attrib
+                    except (TypeError, IndexError, AttributeError):
+                        LOG.error('Could not get metadata for %s', plex_id)
+                        continue
+                    context.add_update(xml[0],
+                                       section_name=section.name,
+                                       section_id=section.section_id)
+                if not self.should_cancel():
+                    context.plexdb.set_sync_checkpoint(section.section_id,
+                                                       section.plex_type,
+                                                       common.CHECKPOINT_DONE,
+                                                       0,
+                                                       self.current_time)
         except RuntimeError:
             LOG.error('Could not entirely process section %s', section)
             self.successful = False
+        else:
+            LOG.debug('Userdata changed for %s and %s items were missing for '
+                      'section %s', updated, len(missing), section)
+
+    def _flush_playstates(self, context, section, seen, changed):
+        context.plexdb.update_last_sync_many(seen,
+                                             section.plex_type,
+                                             self.current_time)
+        context.plexdb.set_userdata_fingerprints(changed)
+        if seen:
+            context.plexdb.set_sync_checkpoint(section.section_id,
+                                               section.plex_type,
+                                               common.CHECKPOINT_PLAYSTATE,
+                                               seen[-1],
+                                               self.current_time)
 
-    def threaded_get_generators(self, kinds, section_queue, items):
+    def priority_sections(self):
         """
-        Getting iterators is costly, so let's do it in a dedicated thread
+        Returns a list of sections holding the items of PRIORITY_HUBS, e.g.
+        On Deck and recently added items, one section per library section and
+        plex_type. The section's iterator is simply the list of hub items
+        """
+        synced = {x.section_id: x for x in app.SYNC.sections
+                  if x.sync_to_kodi}
+        result = {}
+        plex_ids = set()
+        for key in PRIORITY_HUBS:
+            for xml in PF.get_hub_items(key, PRIORITY_HUB_SIZE):
+                plex_type = xml.get('type')
+                try:
+                    section_id = int(xml.get('librarySectionID'))
+                    plex_id = int(xml.get('ratingKey'))
+                except (TypeError, ValueError):
+                    continue
+                if (plex_type not in PRIORITY_TYPES or
+                        section_id not in synced or plex_id in plex_ids):
+                    continue
+                plex_ids.add(plex_id)
+                if (section_id, plex_type) not in result:
+                    section = sections.get_sync_section(synced[section_id],
+                                                        plex_type=plex_type)
+                    section.priority = True
+                    section.iterator = []
+                    result[(section_id, plex_type)] = section
+                result[(section_id, plex_type)].iterator.append(xml)
+        for section in result.values():
+            section.number_of_items = len(section.iterator)
+        LOG.info('Syncing %s recently added and On Deck items first',
+                 len(plex_ids))
+        return list(result.values())
+
+    def threaded_get_generators(self, kinds, section_queue, items, phase,
+                                priority=False):
+        """
+        Getting iterators is costly, so let's do it in a dedicated thread.
+        phase is the common.CHECKPOINT_... we're in; sections an interrupted
+        sync already got past are skipped. The PMS only sends the attributes
+        the phase needs, see common.phase_fields. Set priority=True to put the
+        priority_sections() into section_queue before everything else
+
+        Up to PREFETCH_SECTIONS iterators are built (and start prefetching)
+        at once. The next one is only started once a section has been handed
+        over to section_queue, so at most PREFETCH_SECTIONS sections hold
+        prefetched items. Sections are nevertheless put into section_queue
+        strictly in the order of kinds: shows need to be written before their
+        seasons, seasons before their episodes and so on
         """
         LOG.debug('Start threaded_get_generators')
+        include_fields = common.phase_fields(phase)
         try:
-            for kind in kinds:
-                for section in (x for x in app.SYNC.sections
-                                if x.section_type == kind[1]):
+            if priority:
+                for section in self.priority_sections():
+                    if not self._put_section(section_queue, section):
+                        return
+            jobs = self._iterator_jobs(kinds, items, phase, include_fields)
+            with ThreadPoolExecutor(max_workers=PREFETCH_SECTIONS) as executor:
+                futures = deque()
+                for job in islice(jobs, PREFETCH_SECTIONS):
+                    futures.append(executor.submit(self._get_iterator, *job))
+                while futures:
                     if self.should_cancel():
                         LOG.debug('Need to exit now')
+                        for future in futures:
+                            future.cancel()
                         return
-                    if not section.sync_to_kodi:
-                        LOG.info('User chose to not sync section %s', section)
-                        continue
-                    section = sections.get_sync_section(section,
-                                                        plex_type=kind[0])
-                    timestamp = section.last_sync - UPDATED_AT_SAFETY \
-                        if section.last_sync else None
-                    if items == 'all':
-                        updated_at = None
-                        last_viewed_at = None
-                    elif items == 'watched':
-                        if not timestamp:
-                            # No need to sync playstate updates since section
-                            # has not yet been synched
-                            continue
-                        else:
-                            updated_at = None
-                            last_viewed_at = timestamp
-                    elif items == 'updated':
-                        updated_at = timestamp
-                        last_viewed_at = None
-                    try:
-                        section.iterator = PF.get_section_iterator(
-                            section.section_id,
-                            plex_type=section.plex_type,
-                            updated_at=updated_at,
-                            last_viewed_at=last_viewed_at)
-                    except RuntimeError:
-                        LOG.error('Sync at least partially unsuccessful!')
-                        LOG.error('Error getting section iterator %s', section)
-                    else:
-                        section.number_of_items = section.iterator.total
-                        if section.number_of_items > 0:
-                            section_queue.put(section)
-                            LOG.debug('Put section in queue with %s items: %s',
-                                      section.number_of_items, section)
+                    section = futures.popleft().result()
+                    if section and section.number_of_items > 0:
+                        if not self._put_section(section_queue, section):
+                            for future in futures:
+                                future.cancel()
+                            return
+                        LOG.debug('Put section in queue with %s items: %s',
+                                  section.number_of_items, section)
+                    # Only now start building the next iterator
+                    for job in islice(jobs, 1):
+                        futures.append(executor.submit(self._get_iterator,
+                                                       *job))
         except Exception:
             utils.ERROR(notify=True)
         finally:
             # Sentinel for the section queue
-            section_queue.put(None)
+            self._put_section(section_queue, None)
             LOG.debug('Exiting threaded_get_generators')
 
+    def _iterator_jobs(self, kinds, items, phase, include_fields):
+        """
+        Yields the arguments for _get_iterator for every section we need to
+        sync in this phase, in the order of kinds
+        """
+        for kind in kinds:
+            for section in (x for x in app.SYNC.sections
+                            if x.section_type == kind[1]):
+                if not section.sync_to_kodi:
+                    LOG.info('User chose to not sync section %s', section)
+                    continue
+                section = sections.get_sync_section(section,
+                                                    plex_type=kind[0])
+                checkpoint = self.checkpoints.get((section.section_id,
+                                                   section.plex_type))
+                if checkpoint:
+                    done = common.CHECKPOINT_PHASES.index(checkpoint[0])
+                    if done > common.CHECKPOINT_PHASES.index(phase):
+                        LOG.debug('Interrupted sync already got past %s for '
+                                  '%s', phase, section)
+                        continue
+                    elif (checkpoint[0] == phase and
+                            section.plex_type != v.PLEX_TYPE_ALBUM):
+                        # Albums are not sorted by plex_id
+                        section.resume_after = checkpoint[1]
+                if items == 'updated' and section.last_sync:
+                    updated_at = section.last_sync - UPDATED_AT_SAFETY
+                else:
+                    updated_at = None
+                if phase == common.CHECKPOINT_NEW:
+                    # Skip the section if nothing changed - unless we're
+                    # resuming it or need to sync everything
+                    digest = 'skip' if (updated_at and
+                                        not checkpoint) else 'get'
+                else:
+                    digest = None
+                yield section, updated_at, include_fields, digest
+
+    def _put_section(self, section_queue, section):
+        """
+        Blocks until section_queue accepted section. Returns False if we
+        need to exit - the consumer might already be gone
+        """
+        while True:
+            try:
+                section_queue.put(section, timeout=0.1)
+                return True
+            except queue.Full:
+                if self.should_cancel():
+                    return False
+
+    def _get_iterator(self, section, updated_at, include_fields,
+                      digest=None):
+        """
+        Attaches the PMS iterator to section. Returns section or None if we
+        could not get the iterator
+
+        digest='get' fetches the section's digest from the PMS, see
+        save_digests(). digest='skip' also skips the section if it did not
+        change since the last full sync: section.number_of_items remains 0
+        and no iterator is attached
+        """
+        if digest:
+            unchanged = self.section_unchanged(section)
+            if unchanged and digest == 'skip':
+                LOG.info('Section did not change, skipping it: %s', section)
+                return section
+        try:
+            section.iterator = PF.get_section_iterator(
+                section.section_id,
+                plex_type=section.plex_type,
+                updated_at=updated_at,
+                includeFields=include_fields)
+        except RuntimeError:
+            LOG.error('Sync at least partially unsuccessful!')
+            LOG.error('Error getting section iterator %s', section)
+            return
+        section.number_of_items = section.iterator.total
+        return section
+
+    def section_unchanged(self, section):
+        """
+        Returns True if the PMS reports the same number of items and the same
+        max. updatedAt as at the end of our last full sync and the section's
+        items in the plex.db still match the digest we saved back then
+        """
+        pms = PF.get_section_digest(section.section_id, section.plex_type)
+        if pms is None:
+            return False
+        self.pms_digests[(section.section_id, section.plex_type)] = pms
+        old = section.digest.get(section.plex_type)
+        if not old or list(pms) != old[:2]:
+            return False
+        with PlexDB(lock=False, copy=True) as plexdb:
+            local = plexdb.section_digest(section.section_id,
+                                          section.plex_type)
+        return local == (pms[0], old[2])
+
+    def save_digests(self):
+        """
+        Saves the digests the PMS reported at the start of this - successful -
+        full sync together with the hash of the items we now have in the
+        plex.db. Skipped if the number of items differs, e.g. because items
+        were added on the PMS in the meantime
+        """
+        digests = {}
+        with PlexDB() as plexdb:
+            for (section_id, plex_type), pms in self.pms_digests.items():
+                number_of_items, items_hash = plexdb.section_digest(section_id,
+                                                                    plex_type)
+                if number_of_items != pms[0]:
+                    LOG.debug('Not saving digest for section %s, %s: %s '
+                              'items on the PMS, %s in the plex.db',
+                              section_id, plex_type, pms[0], number_of_items)
+                    continue
+                digests.setdefault(section_id, {})[plex_type] = \
+                    [pms[0], pms[1], items_hash]
+            for section_id, digest in digests.items():
+                plexdb.update_section_digest(section_id, digest)
+
     def full_library_sync(self):
-        section_queue = queue.Queue()
+        # The sections wait in threaded_get_generators, not in this queue
+        section_queue = queue.Queue(maxsize=1)
         processing_queue = bg.ProcessingQueue(maxsize=XML_QUEUE_SIZE)
         kinds = [
             (v.PLEX_TYPE_MOVIE, v.PLEX_TYPE_MOVIE),
@@ -212,9 +475,30 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
                           None,
                           kinds,
                           section_queue,
-                          items='all' if self.repair else 'updated').start()
+                          items='all' if self.repair else 'updated',
+                          phase=common.CHECKPOINT_NEW,
+                          priority=(self.repair or
+                                    not self.install_sync_done or
+                                    bool(self.checkpoints))).start()
         # Do the heavy lifting
-        self.process_new_and_changed_items(section_queue, processing_queue)
+        if not self.install_sync_done:
+            # Very first sync: our DBs are empty, so bulk-load them
+            LOG.info('Initial sync - bulk-loading the databases')
+            drop_secondary_indexes()
+        # Write to staging DBs and merge them into Kodi's DBs batch-wise
+        staged = utils.settings('syncStagingDB') == 'true'
+        if staged:
+            staged = staging.start(('video', 'music') if app.SYNC.enable_music
+                                   else ('video', ))
+        try:
+            self.process_new_and_changed_items(section_queue,
+                                               processing_queue,
+                                               staged)
+        finally:
+            if staged:
+                staging.stop()
+            if not self.install_sync_done:
+                create_secondary_indexes()
         common.update_kodi_library(video=True, music=True)
         if self.should_cancel() or not self.successful:
             return
@@ -225,15 +509,22 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
                 (v.PLEX_TYPE_SONG, v.PLEX_TYPE_ARTIST),
             ])
 
-        # Update playstate progress since last sync - especially useful for
-        # users of very large libraries since this step is very fast
-        # These playstates will be synched twice
-        LOG.debug('Start synching playstate for last watched items')
+        # SYNC PLAYSTATE of ALL items (otherwise we won't pick up on items that
+        # were set to unwatched or changed user ratings). Only items whose
+        # userdata fingerprint changed are written to the Kodi DB. Also mark
+        # all items on the PMS to be able to delete the ones still in Kodi
+        LOG.debug('Start synching playstate and userdata for every item')
+        # Make sure we're not showing an item's title in the sync dialog
+        if not self.show_dialog_userdata and self.dialog:
+            # Close the progress indicator dialog
+            self.dialog.close()
+            self.dialog = None
         bg.FunctionAsTask(self.threaded_get_generators,
                           None,
                           kinds,
                           section_queue,
-                          items='watched').start()
+                          items='all',
+                          phase=common.CHECKPOINT_PLAYSTATE).start()
         self.processing_loop_playstates(section_queue)
         if self.should_cancel() or not self.successful:
             return
@@ -250,24 +541,6 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
             if not playlists.full_sync() or self.should_cancel():
                 return
 
-        # SYNC PLAYSTATE of ALL items (otherwise we won't pick up on items that
-        # were set to unwatched or changed user ratings). Also mark all items on
-        # the PMS to be able to delete the ones still in Kodi
-        LOG.debug('Start synching playstate and userdata for every item')
-        # Make sure we're not showing an item's title in the sync dialog
-        if not self.show_dialog_userdata and self.dialog:
-            # Close the progress indicator dialog
-            self.dialog.close()
-            self.dialog = None
-        bg.FunctionAsTask(self.threaded_get_generators,
-                          None,
-                          kinds,
-                          section_queue,
-                          items='all').start()
-        self.processing_loop_playstates(section_queue)
-        if self.should_cancel() or not self.successful:
-            return
-
         # Delete movies that are not on Plex anymore
         LOG.debug('Looking for items to delete')
         kinds = [
@@ -283,20 +556,23 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
                 (v.PLEX_TYPE_SONG, itemtypes.Song)
             ])
         for plex_type, context in kinds:
-            # Delete movies that are not on Plex anymore
-            while True:
+            # Items we did not encounter on the PMS in this sync - determined
+            # with one single query instead of paging through the table
+            with PlexDB(lock=False) as plexdb:
+                plex_ids = plexdb.stale_plex_ids(plex_type, self.current_time)
+            if plex_ids:
+                LOG.info('Deleting %s %s items', len(plex_ids), plex_type)
+            for start in range(0, len(plex_ids), DELETION_BATCH_SIZE):
                 with context(self.current_time) as ctx:
-                    plex_ids = list(
-                        ctx.plexdb.plex_id_by_last_sync(plex_type,
-                                                        self.current_time,
-                                                        DELETION_BATCH_SIZE))
-                    for plex_id in plex_ids:
+                    for plex_id in plex_ids[start:start + DELETION_BATCH_SIZE]:
                         if self.should_cancel():
                             return
                         ctx.remove(plex_id, plex_type)
-                if len(plex_ids) < DELETION_BATCH_SIZE:
-                    break
         LOG.debug('Done looking for items to delete')
+        self.save_digests()
+        with PlexDB() as plexdb:
+            # Nothing left to resume
+            plexdb.clear_sync_checkpoints()
 
     @utils.log_time
     def _run(self):
@@ -308,6 +584,10 @@ class FullSync(common.LibrarySyncMixin, bg.KillableThread):
             self.full_library_sync()
         finally:
             common.update_kodi_library(video=True, music=True)
+            LOG.info('HTTP connection pools: %s', DU().pool_stats())
+            LOG.info('Circuit breakers: %s', circuit_breaker.stats())
+            LOG.info('Rate limiter: %s', rate_limiter.LIMITER.stats())
+            LOG.debug('Settings reads: %s', utils.settings_stats())
             if self.dialog:
                 self.dialog.close()
             if not self.successful and not self.should_cancel():
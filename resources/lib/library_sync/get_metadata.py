@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
+from time import time
 
-from . import common
+from . import common, records
 from ..plex_api import API
 from .. import backgroundthread, plex_functions as PF, utils, variables as v
+from .. import app
 
 LOG = getLogger('PLEX.sync.get_metadata')
 LOCK = backgroundthread.threading.Lock()
@@ -20,46 +22,70 @@ class GetMetadataThread(common.LibrarySyncMixin,
     
     PKC 4.0.7: Uses batch metadata requests for 25x faster sync
     """
-    def __init__(self, get_metadata_queue, processing_queue):
+    def __init__(self, get_metadata_queue, processing_queue, concurrency):
         self.get_metadata_queue = get_metadata_queue
         self.processing_queue = processing_queue
+        # Shared AdaptiveConcurrency deciding how many threads may download
+        self.concurrency = concurrency
         super(GetMetadataThread, self).__init__()
 
+    @staticmethod
+    def _build_collection_index(section_id):
+        """
+        Returns a dict {<collection index>: <collection xml>} for all Plex
+        collections of the section with section_id. The collections' metadata
+        is downloaded in bulk
+        """
+        index = {}
+        xml = PF.collections(section_id)
+        if xml is None:
+            LOG.error('Could not download collections for section %s',
+                      section_id)
+            return index
+        # Plex id of the collection: collection index as in an item's
+        # metadata "Collection id"
+        indices = {}
+        for collection in xml:
+            indices[utils.cast(int, collection.get('ratingKey'))] = \
+                utils.cast(int, collection.get('index'))
+        if not indices:
+            return index
+        for metadata_list in PF.get_metadata_batches(list(indices),
+                                                     BATCH_SIZE):
+            for metadata in metadata_list:
+                collection_index = indices.get(
+                    utils.cast(int, metadata.get('ratingKey')))
+                if collection_index is not None:
+                    # Mimick the MediaContainer we would get for a single item
+                    index[collection_index] = [records.compact(metadata)]
+        LOG.debug('Indexed %s collections for section %s',
+                  len(index), section_id)
+        return index
+
     def _collections(self, item):
-        api = API(item['xml'][0])
-        collection_match = item['section'].collection_match
-        collection_xmls = item['section'].collection_xmls
-        if collection_match is None:
-            collection_match = PF.collections(api.library_section_id())
-            if collection_match is None:
-                LOG.error('Could not download collections')
-                return
-            # Extract what we need to know
-            collection_match = \
-                [(utils.cast(int, x.get('index')),
-                  utils.cast(int, x.get('ratingKey'))) for x in collection_match]
-        item['children'] = {}
-        for plex_set_id, set_name in api.collections():
-            if self.should_cancel():
-                return
-            if plex_set_id not in collection_xmls:
-                # Get Plex metadata for collections - a pain
-                for index, collection_plex_id in collection_match:
-                    if index == plex_set_id:
-                        collection_xml = PF.GetPlexMetadata(collection_plex_id)
-                        try:
-                            collection_xml[0].attrib
-                        except (TypeError, IndexError, AttributeError):
-                            LOG.error('Could not get collection %s %s',
-                                      collection_plex_id, set_name)
-                            continue
-                        collection_xmls[plex_set_id] = collection_xml
-                        break
-                else:
-                    LOG.error('Did not find Plex collection %s %s',
-                              plex_set_id, set_name)
-                    continue
-            item['children'][plex_set_id] = collection_xmls[plex_set_id]
+        """
+        Attaches the metadata of the item's collections as item.children.
+        Only needed for the collections' artwork
+        """
+        if not app.SYNC.artwork:
+            return
+        collections = API(item.xml).collections()
+        if not collections:
+            return
+        section = item.section
+        with LOCK:
+            # Build the index only once per section
+            if section.collection_index is None:
+                section.collection_index = \
+                    self._build_collection_index(section.section_id)
+        item.children = {}
+        for plex_set_id, set_name in collections:
+            try:
+                item.children[plex_set_id] = \
+                    section.collection_index[plex_set_id]
+            except KeyError:
+                LOG.error('Did not find Plex collection %s %s',
+                          plex_set_id, set_name)
 
     def _process_abort(self, count, section):
         # Make sure other threads will also receive sentinel
@@ -70,7 +96,7 @@ class GetMetadataThread(common.LibrarySyncMixin,
     def _process_skipped_item(self, count, section):
         section.sync_successful = False
         # Add a "dummy" item so we're not skipping a beat
-        self.processing_queue.put((count, {'section': section, 'xml': None}))
+        self.processing_queue.put((count, records.SyncItem(section)))
 
     def _run(self):
         # PKC 4.0.7: Batch metadata loading for 25x speedup
@@ -123,14 +149,14 @@ class GetMetadataThread(common.LibrarySyncMixin,
                 self._process_single_item(count, plex_id, section)
             return
         
-        # Separate items that need individual processing (collections, children)
+        # Separate items that need individual processing (children)
         needs_individual = []
         batch_ids = []
         item_map = {}  # Map plex_id to (count, section)
         
         for count, plex_id, section in batch_items:
-            # Items with collections or children need individual processing after
-            if section.plex_type == v.PLEX_TYPE_MOVIE or section.get_children:
+            # Items with children need individual processing after
+            if section.get_children:
                 needs_individual.append((count, plex_id, section))
             else:
                 batch_ids.append(plex_id)
@@ -139,32 +165,49 @@ class GetMetadataThread(common.LibrarySyncMixin,
         # Batch-load metadata for simple items
         if batch_ids:
             LOG.debug('Batch-loading %d items', len(batch_ids))
-            metadata_list = PF.GetPlexMetadataBatch(batch_ids, BATCH_SIZE)
-            
-            # Create metadata map for quick lookup
-            metadata_by_id = {}
-            for metadata in metadata_list:
-                plex_id = metadata.get('ratingKey')
-                if plex_id:
-                    metadata_by_id[int(plex_id)] = metadata
-            
-            # Process batch results
+            if not self.concurrency.acquire(self.should_cancel):
+                return
+            # Only count the time we wait for the PMS, not our processing
+            elapsed = 0.0
+            fetched = 0
+            batches = PF.get_metadata_batches(batch_ids, BATCH_SIZE)
+            try:
+                while not self.should_cancel():
+                    start = time()
+                    metadata_list = next(batches, None)
+                    elapsed += time() - start
+                    if metadata_list is None:
+                        break
+                    fetched += len(metadata_list)
+                    lacks_extras = self._lacks_extras(metadata_list)
+                    # Process the batch while later ones are still in flight
+                    for metadata in metadata_list:
+                        plex_id = utils.cast(int, metadata.get('ratingKey'))
+                        if plex_id not in item_map:
+                            continue
+                        count, section = item_map.pop(plex_id)
+                        if (lacks_extras and
+                                section.plex_type == v.PLEX_TYPE_MOVIE):
+                            # Get trailers and markers one by one instead
+                            needs_individual.append((count, plex_id, section))
+                            continue
+                        item = records.SyncItem(
+                            section,
+                            xml=records.compact(metadata))
+                        if section.plex_type == v.PLEX_TYPE_MOVIE:
+                            self._collections(item)
+                        self.processing_queue.put((count, item))
+            finally:
+                batches.close()
+                self.concurrency.release(elapsed,
+                                         items=len(batch_ids),
+                                         error=not fetched)
+            if self.should_cancel():
+                return
+            # Items the PMS did not send us
             for plex_id in batch_ids:
-                if self.should_cancel():
-                    break
-                    
-                count, section = item_map[plex_id]
-                
-                if plex_id in metadata_by_id:
-                    # Wrap single metadata in MediaContainer-like structure
-                    xml = [metadata_by_id[plex_id]]
-                    item = {
-                        'xml': xml,
-                        'children': None,
-                        'section': section
-                    }
-                    self.processing_queue.put((count, item))
-                else:
+                if plex_id in item_map:
+                    count, section = item_map.pop(plex_id)
                     LOG.error("Could not get metadata for %s. Skipping item", plex_id)
                     self._process_skipped_item(count, section)
         
@@ -174,43 +217,64 @@ class GetMetadataThread(common.LibrarySyncMixin,
                 break
             self._process_single_item(count, plex_id, section)
     
+    @staticmethod
+    def _lacks_extras(metadata_list):
+        """
+        Returns True if the PMS ignored includeExtras for this batch: not a
+        single movie carries an Extras element. API.trailer() would return
+        None and we'd lose every trailer
+        """
+        movies = [x for x in metadata_list
+                  if x.get('type') == v.PLEX_TYPE_MOVIE]
+        if not movies or any(x.find('Extras') is not None for x in movies):
+            return False
+        LOG.warn('PMS sent %s movies without extras in a batch, downloading '
+                 'them one by one', len(movies))
+        return True
+
     def _process_single_item(self, count, plex_id, section):
         """
-        Process single item with collections or children
+        Process single item with children
         PKC 4.0.7: Fallback for complex items that can't be batched
         """
-        item = {
-            'xml': PF.GetPlexMetadata(plex_id),
-            'children': None,
-            'section': section
-        }
-        if item['xml'] is None:
+        while True:
+            if not self.concurrency.acquire(self.should_cancel):
+                return
+            start = time()
+            xml = PF.GetPlexMetadata(plex_id)
+            self.concurrency.release(time() - start,
+                                     error=xml is None or xml == 401)
+            if xml != 401 or not self.concurrency.can_back_off():
+                break
+            LOG.warn('HTTP 401 returned by PMS for %s. Too much strain? '
+                     'Retrying with fewer simultaneous downloads', plex_id)
+            self.sleep(1)
+        if xml is None:
             LOG.error("Could not get metadata for %s. Skipping item", plex_id)
             self._process_skipped_item(count, section)
             return
-        elif item['xml'] == 401:
+        elif xml == 401:
             LOG.error('HTTP 401 returned by PMS. Too much strain? '
                       'Cancelling sync for now')
             utils.window('plex_scancrashed', value='401')
             self._process_abort(count, section)
             return
+        # Only keep the item itself, not the MediaContainer around it
+        item = records.SyncItem(section, xml=records.compact(xml[0]))
         
         if section.plex_type == v.PLEX_TYPE_MOVIE:
-            # Check for collections/sets
-            collections = False
-            for child in item['xml'][0]:
-                if child.tag == 'Collection':
-                    collections = True
-                    break
-            if collections:
-                with LOCK:
-                    self._collections(item)
+            self._collections(item)
         
         if section.get_children:
             if self.should_cancel():
                 self._process_abort(count, section)
                 return
+            if not self.concurrency.acquire(self.should_cancel):
+                return
+            start = time()
             children_xml = PF.GetAllPlexChildren(plex_id)
+            self.concurrency.release(time() - start,
+                                     error=children_xml is None)
             try:
                 children_xml[0].attrib
             except (TypeError, IndexError, AttributeError):
@@ -218,6 +282,6 @@ class GetMetadataThread(common.LibrarySyncMixin,
                 self._process_skipped_item(count, section)
                 return
             else:
-                item['children'] = children_xml
+                item.children = records.compact_children(children_xml)
         
         self.processing_queue.put((count, item))
@@ -1,22 +1,50 @@
 # -*- coding: utf-8 -*-
 from logging import getLogger
 
-from . import common, sections
+from . import common, sections, records
+from .commit_policy import CommitPolicy
 from ..plex_db import PlexDB
+from ..exceptions import StagingConflict
 from .. import backgroundthread, app
 
 LOG = getLogger('PLEX.sync.process_metadata')
 
-COMMIT_TO_DB_EVERY_X_ITEMS = 500
+# Commit after this many items, rows written or seconds, whatever comes first.
+# Leave the DB context after LOCK_SECONDS to let other PKC threads access
+# the DBs
+COMMIT_MAX_ITEMS = 500
+COMMIT_MAX_ROWS = 20000
+COMMIT_MAX_SECONDS = 2.0
+LOCK_SECONDS = 10.0
+# Larger transactions while bulk-loading the empty DBs of a fresh install
+BULK_COMMIT_MAX_ITEMS = 5000
+BULK_COMMIT_MAX_ROWS = 200000
+BULK_COMMIT_MAX_SECONDS = 30.0
+BULK_LOCK_SECONDS = 60.0
 
 
 class ProcessMetadataThread(common.LibrarySyncMixin,
                             backgroundthread.KillableThread):
     """
-    Invoke once in order to process the received PMS metadata xmls
+    Invoke once in order to process the received PMS metadata xmls. Set
+    bulk=True for the very first sync, see db.connect. Set staged=True to
+    write via kodi_db.staging
     """
-    def __init__(self, current_time, processing_queue, update_progressbar):
+    def __init__(self, current_time, processing_queue, update_progressbar,
+                 bulk=False, staged=False):
         self.current_time = current_time
+        self.bulk = bulk
+        self.staged = staged
+        if bulk:
+            self.commit_policy = CommitPolicy(BULK_COMMIT_MAX_ITEMS,
+                                              BULK_COMMIT_MAX_ROWS,
+                                              BULK_COMMIT_MAX_SECONDS,
+                                              BULK_LOCK_SECONDS)
+        else:
+            self.commit_policy = CommitPolicy(COMMIT_MAX_ITEMS,
+                                              COMMIT_MAX_ROWS,
+                                              COMMIT_MAX_SECONDS,
+                                              LOCK_SECONDS)
         self.processing_queue = processing_queue
         self.update_progressbar = update_progressbar
         self.last_section = sections.Section()
@@ -39,10 +67,20 @@ class ProcessMetadataThread(common.LibrarySyncMixin,
                 self.last_section.sync_successful):
             # Check for should_cancel() because we cannot be sure that we
             # processed every item of the section
+            if self.last_section.priority:
+                # The section's other items are still to come
+                LOG.info('Finished processing priority items of %s',
+                         self.last_section)
+                return
             with PlexDB() as plexdb:
                 # Set the new time mark for the next delta sync
                 plexdb.update_section_last_sync(self.last_section.section_id,
                                                 self.current_time)
+                plexdb.set_sync_checkpoint(self.last_section.section_id,
+                                           self.last_section.plex_type,
+                                           common.CHECKPOINT_PLAYSTATE,
+                                           0,
+                                           self.current_time)
             LOG.info('Finished processing section successfully: %s',
                      self.last_section)
         elif self.last_section and not self.last_section.sync_successful:
@@ -50,42 +88,110 @@ class ProcessMetadataThread(common.LibrarySyncMixin,
             self.successful = False
 
     def _get(self):
-        item = {'xml': None}
-        while item and item['xml'] is None:
+        item = records.SyncItem(None)
+        while item and item.xml is None:
             item = self.processing_queue.get()
             self.processing_queue.task_done()
         return item
 
+    def checkpoint(self, context, section, plex_id):
+        """
+        Records that all of section's items up to plex_id are about to be
+        committed - together with these items
+        """
+        if (plex_id is not None and section.sync_successful and
+                not section.priority):
+            context.plexdb.set_sync_checkpoint(section.section_id,
+                                               section.plex_type,
+                                               common.CHECKPOINT_NEW,
+                                               plex_id,
+                                               self.current_time)
+
+    def write_again(self, section, items):
+        """
+        Writes items once more after merging them from the staging DB failed:
+        first via a fresh snapshot of Kodi's DB, then directly to Kodi's DB,
+        where nothing can conflict
+        """
+        if not items:
+            return
+        for staged in (True, False):
+            try:
+                with section.context(self.current_time,
+                                     bulk=self.bulk,
+                                     staged=staged) as context:
+                    for item in items:
+                        context.add_update(item.xml,
+                                           section_name=section.name,
+                                           section_id=section.section_id,
+                                           children=item.children)
+                    self.checkpoint(context,
+                                    section,
+                                    int(items[-1].xml.get('ratingKey')))
+            except StagingConflict as err:
+                LOG.warn('Could not merge the items again, writing them to '
+                         'the Kodi DB directly: %s', err)
+            else:
+                section.count += len(items)
+                return
+
     def _run(self):
-        # There are 2 sentinels: None for aborting/ending this thread, the dict
-        # {'section': section, 'xml': None} for skipped/invalid items
+        # There are 2 sentinels: None for aborting/ending this thread, a
+        # SyncItem(section) with xml=None for skipped/invalid items
         item = self._get()
         if item:
-            section = item['section']
-            processed = 0
+            section = item.section
             self.start_section(section)
         while not self.should_cancel():
             if item is None:
                 break
-            elif item['section'] != section:
+            elif item.section != section:
                 # We received an entirely new section
-                self.start_section(item['section'])
-                section = item['section']
-            with section.context(self.current_time) as context:
-                while not self.should_cancel():
-                    if item is None or item['section'] != section:
-                        break
-                    self.update_progressbar(section,
-                                            item['xml'][0].get('title'),
-                                            section.count)
-                    context.add_update(item['xml'][0],
-                                       section_name=section.name,
-                                       section_id=section.section_id,
-                                       children=item['children'])
-                    processed += 1
-                    section.count += 1
-                    if processed == COMMIT_TO_DB_EVERY_X_ITEMS:
-                        processed = 0
-                        context.commit()
+                self.start_section(item.section)
+                section = item.section
+            # Items written since the last commit
+            pending = []
+            try:
+                with section.context(self.current_time,
+                                     bulk=self.bulk,
+                                     staged=self.staged) as context:
+                    self.commit_policy.start(context)
+                    plex_id = None
+                    while not self.should_cancel():
+                        if item is None or item.section != section:
+                            break
+                        if self.commit_policy.lock_expired():
+                            # Let other threads access the DBs for a bit
+                            break
+                        self.update_progressbar(section,
+                                                item.xml.get('title'),
+                                                section.count)
+                        context.add_update(item.xml,
+                                           section_name=section.name,
+                                           section_id=section.section_id,
+                                           children=item.children)
+                        pending.append(item)
+                        plex_id = int(item.xml.get('ratingKey'))
+                        section.count += 1
+                        self.commit_policy.items_done()
+                        if self.commit_policy.should_commit(context):
+                            self.checkpoint(context, section, plex_id)
+                            self.commit_policy.commit(context)
+                            pending = []
+                        item = self._get()
+                    self.checkpoint(context, section, plex_id)
+            except StagingConflict as err:
+                # Kodi changed rows we changed, too. Nothing of the batch
+                # made it into the Kodi DB or the plex.db
+                LOG.warn('Could not merge %s items into the Kodi DB, writing '
+                         'them again: %s', len(pending), err)
+                if pending and pending[-1] is item:
+                    # Merging failed on a commit, not when leaving the context
                     item = self._get()
+                section.count -= len(pending)
+                self.write_again(section, pending)
+            if self.commit_policy.lock_expired():
+                # Give other threads a chance to grab the DB locks
+                self.sleep(0.1)
         self.finish_last_section()
+        self.commit_policy.log_summary()
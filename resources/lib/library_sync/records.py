@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Compact records handed from the GetMetadataThreads to the
+ProcessMetadataThread via the processing_queue. Up to XML_QUEUE_SIZE of them
+are held in memory, so we only keep what itemtypes.*.add_update consumes.
+"""
+# Subelements of a PMS item that itemtypes.*.add_update reads (e.g. via
+# plex_api.Base._scan_children). Everything else, e.g. reviews, chapters or
+# related items, is dropped before queueing
+KEEP_TAGS = frozenset((
+    'Media',
+    'Role',
+    'Genre',
+    'Country',
+    'Director',
+    'Writer',
+    'Producer',
+    'Location',
+    'Collection',
+    'Guid',
+    'Marker',
+    'Label',
+    'Mood',
+    'Extras',
+))
+
+
+class SyncItem(object):
+    """
+    One library item to be written to the Kodi DB.
+        section:    the sections.Section() the item belongs to
+        xml:        compacted PMS etree element of the item itself (NOT the
+                    MediaContainer). None for a skipped item
+        children:   None, a dict {<collection index>: <collection xml>} for
+                    movies or the compacted children xml (e.g. an album's
+                    tracks)
+    """
+    __slots__ = ('section', 'xml', 'children')
+
+    def __init__(self, section, xml=None, children=None):
+        self.section = section
+        self.xml = xml
+        self.children = children
+
+
+def compact(element):
+    """
+    Drops all subelements of the PMS item element that we won't need for the
+    Kodi DB, in-place. Only the attributes of the extras (e.g. trailers) are
+    kept. Returns element
+    """
+    element[:] = [x for x in element if x.tag in KEEP_TAGS]
+    for extras in element.iterfind('Extras'):
+        for extra in extras:
+            del extra[:]
+    return element
+
+
+def compact_children(xml):
+    """
+    Compacts every child of the MediaContainer xml, in-place. Returns xml
+    """
+    for child in xml:
+        compact(child)
+    return xml
@@ -81,9 +81,15 @@ class Section(object):
         self.order = None
         # Original PMS xml for this section, including children
         self.xml = None
+        # {plex_type: [number of items, max. updatedAt, hash]} as of the last
+        # successful full sync
+        self.digest = {}
         # A section_type encompasses possible several plex_types! E.g. shows
         # contain shows, seasons, episodes
         self._plex_type = None
+        # Set for the library sync's priority lane: this section only holds
+        # e.g. recently added items, not the entire PMS library section
+        self.priority = False
         if xml_element is not None:
             self.from_xml(xml_element)
         elif section_db_element:
@@ -113,6 +119,7 @@ class Section(object):
             return False
         return (self.section_id == section.section_id and
                 self.name == section.name and
+                self.priority == section.priority and
                 (self.plex_type == section.plex_type if self.plex_type else
                  self.section_type == section.section_type))
 
@@ -183,6 +190,7 @@ class Section(object):
         self.kodi_tagid = section_db_element['kodi_tagid']
         self.sync_to_kodi = section_db_element['sync_to_kodi']
         self.last_sync = section_db_element['last_sync']
+        self.digest = section_db_element['digest']
 
     def from_xml(self, xml_element):
         """
@@ -222,7 +230,8 @@ class Section(object):
                                self.section_type,
                                self.kodi_tagid,
                                self.sync_to_kodi,
-                               self.last_sync)
+                               self.last_sync,
+                               self.digest)
         else:
             with PlexDB(lock=False) as plexdb:
                 plexdb.add_section(self.section_id,
@@ -230,7 +239,8 @@ class Section(object):
                                    self.section_type,
                                    self.kodi_tagid,
                                    self.sync_to_kodi,
-                                   self.last_sync)
+                                   self.last_sync,
+                                   self.digest)
 
     def addon_path(self, args):
         """
@@ -457,17 +467,19 @@ def get_sync_section(section, plex_type):
     # Some more init stuff
     # Has sync for this section been successful?
     section.sync_successful = True
-    # List of tuples: (collection index [as in an item's metadata with
-    # "Collection id"], collection plex id)
-    section.collection_match = None
-    # Dict with entries of the form <collection index>: <collection xml>
-    section.collection_xmls = {}
+    # Dict with entries of the form <collection index [as in an item's
+    # metadata with "Collection id"]>: <collection xml>. Built once per
+    # section by the first GetMetadataThread that needs it
+    section.collection_index = None
     # Keep count during sync
     section.count = 0
     # Total number of items that we need to sync
     section.number_of_items = 0
     # Iterator to get one sync item after the other
     section.iterator = None
+    # An interrupted full sync already committed every item up to and
+    # including this plex_id
+    section.resume_after = 0
     return section
 
 
@@ -497,6 +509,7 @@ def _retrieve_old_settings(sections, old_sections):
         section.kodi_tagid
         section.sync_to_kodi
         section.last_sync
+        section.digest
     """
     for section in sections:
         for old_section in old_sections:
@@ -505,6 +518,7 @@ def _retrieve_old_settings(sections, old_sections):
                 section.kodi_tagid = old_section.kodi_tagid
                 section.sync_to_kodi = old_section.sync_to_kodi
                 section.last_sync = old_section.last_sync
+                section.digest = old_section.digest
 
 
 def _delete_kodi_db_items(section):
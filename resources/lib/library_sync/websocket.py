@@ -160,7 +160,7 @@ def process_websocket_messages():
 def process_new_items_batch(indexed_messages):
     """
     PKC 4.2: Batch process multiple new/updated items
-    Uses GetPlexMetadataBatch for efficient loading
+    Uses get_metadata_batches for efficient loading
     
     Args:
         indexed_messages: List of (index, message) tuples
@@ -176,64 +176,76 @@ def process_new_items_batch(indexed_messages):
     for i, message in indexed_messages:
         plex_id = message['plex_id']
         metadata_cache.invalidate_item(plex_id)
-        plex_ids.append(plex_id)
-        id_to_index[plex_id] = i
+        if plex_id not in id_to_index:
+            plex_ids.append(plex_id)
+        # Several messages might concern the same item
+        id_to_index.setdefault(plex_id, []).append(i)
     
     LOG.debug('Batch-loading %d websocket items', len(plex_ids))
     
-    # Batch-load all metadata
-    metadata_list = PF.GetPlexMetadataBatch(plex_ids, INCREMENTAL_BATCH_SIZE)
+    # Process every batch as soon as it arrives, while later batches are
+    # still downloading. Batches arrive in the order of plex_ids, i.e. of
+    # the messages - e.g. a new show before its seasons and episodes
+    position = 0
+    for metadata_list in PF.get_metadata_batches(plex_ids,
+                                                 INCREMENTAL_BATCH_SIZE):
+        received = {utils.cast(int, x.get('ratingKey')): x
+                    for x in metadata_list}
+        # The PMS might answer in any order - stick to the messages' one
+        for plex_id in plex_ids[position:position + INCREMENTAL_BATCH_SIZE]:
+            if plex_id in received:
+                result = _process_batch_item(plex_id, received[plex_id])
+            else:
+                LOG.error('Could not download metadata for %s', plex_id)
+                result = (False, False, False)
+            results.extend((i, result) for i in id_to_index[plex_id])
+        position += INCREMENTAL_BATCH_SIZE
     
-    # Create lookup map
-    metadata_by_id = {}
-    for metadata in metadata_list:
-        plex_id = metadata.get('ratingKey')
-        if plex_id:
-            metadata_by_id[int(plex_id)] = metadata
+    return results
+
+
+class XMLContainer(object):
+    """
+    Wraps a batch-downloaded metadata element to offer the get() of the
+    MediaContainer we would get for a single item, see
+    process_new_item_message
+    """
+    def __init__(self, data):
+        self._data = data
+
+    def get(self, key, default=None):
+        return self._data.attrib.get(key, default) \
+            if hasattr(self._data, 'attrib') else default
+
+
+def _process_batch_item(plex_id, xml_data):
+    """
+    Adds or updates the item with the batch-downloaded metadata xml_data.
+    Returns the tuple (successful, video, music)
+    """
+    try:
+        plex_type = xml_data.attrib['type']
+    except (AttributeError, KeyError):
+        LOG.error('Invalid metadata for %s', plex_id)
+        return False, False, False
     
-    # Process each item
-    for i, message in indexed_messages:
-        plex_id = message['plex_id']
-        
-        if plex_id not in metadata_by_id:
-            LOG.error('Could not download metadata for %s', plex_id)
-            results.append((i, (False, False, False)))
-            continue
-        
-        xml_data = metadata_by_id[plex_id]
-        try:
-            plex_type = xml_data.attrib['type']
-        except (AttributeError, KeyError):
-            LOG.error('Invalid metadata for %s', plex_id)
-            results.append((i, (False, False, False)))
-            continue
-        
-        LOG.debug("Processing new/updated PMS item: %s", plex_id)
-        
-        # Wrap in container-like structure for add_update
-        class XMLContainer:
-            def __init__(self, data):
-                self._data = data
-            def get(self, key, default=None):
-                return self._data.attrib.get(key, default) if hasattr(self._data, 'attrib') else default
-        
-        container = XMLContainer(xml_data)
-        
-        with itemtypes.ITEMTYPE_FROM_PLEXTYPE[plex_type](timing.unix_timestamp()) as typus:
-            typus.add_update(xml_data,
-                             section_name=container.get('librarySectionTitle'),
-                             section_id=utils.cast(int, container.get('librarySectionID')))
-        
-        cache_artwork(plex_id, plex_type)
-        
-        # Queue additional metadata task
-        task = ProcessMetadataTask()
-        task.setup(plex_id, plex_type, refresh=False)
-        backgroundthread.BGThreader.addTask(task)
-        
-        results.append((i, (True, plex_type in v.PLEX_VIDEOTYPES, plex_type in v.PLEX_AUDIOTYPES)))
+    LOG.debug("Processing new/updated PMS item: %s", plex_id)
     
-    return results
+    container = XMLContainer(xml_data)
+    
+    with itemtypes.ITEMTYPE_FROM_PLEXTYPE[plex_type](timing.unix_timestamp()) as typus:
+        typus.add_update(xml_data,
+                         section_name=container.get('librarySectionTitle'),
+                         section_id=utils.cast(int, container.get('librarySectionID')))
+    
+    cache_artwork(plex_id, plex_type)
+    
+    # Queue additional metadata task
+    task = ProcessMetadataTask()
+    task.setup(plex_id, plex_type, refresh=False)
+    backgroundthread.BGThreader.addTask(task)
+    
+    return True, plex_type in v.PLEX_VIDEOTYPES, plex_type in v.PLEX_AUDIOTYPES
 
 
 def process_new_item_message(message):
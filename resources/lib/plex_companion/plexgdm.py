@@ -28,7 +28,7 @@ import socket
 
 from ..downloadutils import DownloadUtils as DU
 from .. import backgroundthread
-from .. import utils, app, variables as v
+from .. import utils, app, variables as v, circuit_breaker
 
 log = logging.getLogger('PLEX.plexgdm')
 
@@ -99,7 +99,8 @@ class plexgdm(backgroundthread.KillableThread):
             return
         log.debug('Checking whether we are still listed as GDM Plex Companion'
                   'client on our PMS')
-        xml = DU().downloadUrl('{server}/clients')
+        xml = DU().downloadUrl('{server}/clients',
+                               request_class=circuit_breaker.COMPANION)
         try:
             xml[0].attrib
         except (TypeError, IndexError, AttributeError):
@@ -17,6 +17,7 @@ from .. import json_rpc as js
 from .. import variables as v
 from .. import app
 from .. import exceptions
+from .. import circuit_breaker
 
 
 log = getLogger('PLEX.companion.processing')
@@ -90,7 +91,8 @@ def process_playlist(containerKey, typus, key, offset, token):
     except ValueError:
         # E.g. Plex web does not supply the media type
         # Still need to figure out the type (video vs. music vs. pix)
-        xml = PF.GetPlexMetadata(key)
+        xml = PF.GetPlexMetadata(key,
+                                 request_class=circuit_breaker.COMPANION)
         try:
             xml[0].attrib
         except (AttributeError, IndexError, TypeError):
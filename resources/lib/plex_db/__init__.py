@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from .common import PlexDBBase, initialize, wipe, PLEXDB_LOCK
+from .common import drop_secondary_indexes, create_secondary_indexes
 from .tvshows import TVShows
 from .movies import Movies
 from .music import Music
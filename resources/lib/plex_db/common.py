@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 from threading import Lock
+from array import array
 
 from .. import db, variables as v
 
@@ -16,6 +17,22 @@ SUPPORTED_KODI_TYPES = (
     v.KODI_TYPE_SONG
 )
 
+# Non-unique indexes that library sync never reads while writing items, only
+# later on (e.g. last_sync to find deleted items). Dropped while bulk-loading
+SECONDARY_INDEXES = (
+    ('ix_movie_1', 'CREATE INDEX IF NOT EXISTS ix_movie_1 ON movie (last_sync)'),
+    ('ix_movie_3', 'CREATE INDEX IF NOT EXISTS ix_movie_3 ON movie (plex_guid)'),
+    ('ix_show_1', 'CREATE INDEX IF NOT EXISTS ix_show_1 ON show (last_sync)'),
+    ('ix_show_3', 'CREATE INDEX IF NOT EXISTS ix_show_3 ON show (plex_guid)'),
+    ('ix_season_1', 'CREATE INDEX IF NOT EXISTS ix_season_1 ON season (last_sync)'),
+    ('ix_season_3', 'CREATE INDEX IF NOT EXISTS ix_season_3 ON season (plex_guid)'),
+    ('ix_episode_1', 'CREATE INDEX IF NOT EXISTS ix_episode_1 ON episode (last_sync)'),
+    ('ix_episode_3', 'CREATE INDEX IF NOT EXISTS ix_episode_3 ON season (plex_guid)'),
+    ('ix_artist_1', 'CREATE INDEX IF NOT EXISTS ix_artist_1 ON artist (last_sync)'),
+    ('ix_album_1', 'CREATE INDEX IF NOT EXISTS ix_album_1 ON album (last_sync)'),
+    ('ix_track_1', 'CREATE INDEX IF NOT EXISTS ix_track_1 ON track (last_sync)'),
+)
+
 
 class PlexDBBase(object):
     """
@@ -129,14 +146,15 @@ class PlexDBBase(object):
         method = getattr(self, 'entry_to_%s' % v.PLEX_TYPE_FROM_KODI_TYPE[kodi_type])
         return method(self.cursor.fetchone())
 
-    def plex_id_by_last_sync(self, plex_type, last_sync, limit):
+    def stale_plex_ids(self, plex_type, last_sync):
         """
-        Returns an iterator for all items where the last_sync is NOT identical
+        Returns a compact array('q') of ALL plex_ids where the last_sync is NOT
+        identical, i.e. items we did not encounter on the PMS during the sync
+        that started at last_sync
         """
-        query = '''
-            SELECT plex_id FROM %s WHERE last_sync <> ? LIMIT %s
-        ''' % (plex_type, limit)
-        return (x[0] for x in self.cursor.execute(query, (last_sync, )))
+        query = 'SELECT plex_id FROM %s WHERE last_sync <> ?' % plex_type
+        return array('q', (x[0] for x in self.cursor.execute(query,
+                                                              (last_sync, ))))
 
     def checksum(self, plex_id, plex_type):
         """
@@ -149,6 +167,28 @@ class PlexDBBase(object):
         except TypeError:
             pass
 
+    def checksums_by_section(self, section_id, plex_type):
+        """
+        Returns an iterator of (plex_id, checksum) tuples for every item of
+        plex_type in the section with section_id
+        """
+        return self.cursor.execute(
+            'SELECT plex_id, checksum FROM %s WHERE section_id = ?' % plex_type,
+            (section_id, ))
+
+    def section_digest(self, section_id, plex_type):
+        """
+        Returns the tuple (number of items, hash) for the plex_type items of
+        the section with section_id. The hash does not depend on the order
+        of the items and changes with any item's plex_id or updatedAt, as
+        both are part of the checksum
+        """
+        self.cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(checksum %% 4294967291), 0)
+            FROM %s WHERE section_id = ?
+        ''' % plex_type, (section_id, ))
+        return tuple(self.cursor.fetchone())
+
     def update_last_sync(self, plex_id, plex_type, last_sync):
         """
         Sets a new timestamp for plex_id
@@ -156,11 +196,42 @@ class PlexDBBase(object):
         self.cursor.execute('UPDATE %s SET last_sync = ? WHERE plex_id = ?' % plex_type,
                             (last_sync, plex_id))
 
+    def update_last_sync_many(self, plex_ids, plex_type, last_sync):
+        """
+        Sets a new timestamp for all plex_ids [iterable] in one go
+        """
+        self.cursor.executemany(
+            'UPDATE %s SET last_sync = ? WHERE plex_id = ?' % plex_type,
+            ((last_sync, plex_id) for plex_id in plex_ids))
+
+    def userdata_fingerprints(self, section_id, plex_type):
+        """
+        Returns an iterator of (plex_id, fingerprint) tuples for every item of
+        plex_type in the section with section_id that has a stored userdata
+        fingerprint
+        """
+        query = '''
+            SELECT t.plex_id, u.fingerprint FROM %s AS t
+            INNER JOIN userdata AS u ON u.plex_id = t.plex_id
+            WHERE t.section_id = ?
+        ''' % plex_type
+        return self.cursor.execute(query, (section_id, ))
+
+    def set_userdata_fingerprints(self, entries):
+        """
+        Stores the userdata fingerprints for entries, an iterable of
+        (plex_id, fingerprint) tuples
+        """
+        self.cursor.executemany(
+            'INSERT OR REPLACE INTO userdata(plex_id, fingerprint) VALUES (?, ?)',
+            entries)
+
     def remove(self, plex_id, plex_type):
         """
         Removes the item from our Plex db
         """
         self.cursor.execute('DELETE FROM %s WHERE plex_id = ?' % plex_type, (plex_id, ))
+        self.cursor.execute('DELETE FROM userdata WHERE plex_id = ?', (plex_id, ))
 
     def every_plex_id(self, plex_type, offset, limit):
         """
@@ -244,8 +315,15 @@ def initialize():
                     plex_type TEXT,
                     kodi_tagid INTEGER,
                     sync_to_kodi INTEGER,
-                    last_sync INTEGER)
+                    last_sync INTEGER,
+                    digest TEXT)
             ''')
+            # plex.db files created before we saved section digests
+            columns = [x[1] for x in plexdb.cursor.execute(
+                'PRAGMA table_info(sections)').fetchall()]
+            if 'digest' not in columns:
+                plexdb.cursor.execute(
+                    'ALTER TABLE sections ADD COLUMN digest TEXT')
             plexdb.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS movie(
                     plex_id INTEGER PRIMARY KEY,
@@ -330,6 +408,20 @@ def initialize():
                     kodi_pathid INTEGER,
                     last_sync INTEGER)
             ''')
+            plexdb.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS userdata(
+                    plex_id INTEGER PRIMARY KEY,
+                    fingerprint INTEGER)
+            ''')
+            plexdb.cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sync_checkpoints(
+                    section_id INTEGER,
+                    plex_type TEXT,
+                    phase TEXT,
+                    position INTEGER,
+                    sync_started INTEGER,
+                    PRIMARY KEY (section_id, plex_type))
+            ''')
             plexdb.cursor.execute('''
                 CREATE TABLE IF NOT EXISTS playlists(
                     plex_id INTEGER PRIMARY KEY,
@@ -341,29 +433,40 @@ def initialize():
             ''')
             # DB indicees for faster lookups
             commands = (
-                'CREATE INDEX IF NOT EXISTS ix_movie_1 ON movie (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_movie_2 ON movie (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_movie_3 ON movie (plex_guid)',
-                'CREATE INDEX IF NOT EXISTS ix_show_1 ON show (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_show_2 ON show (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_show_3 ON show (plex_guid)',
-                'CREATE INDEX IF NOT EXISTS ix_season_1 ON season (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_season_2 ON season (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_season_3 ON season (plex_guid)',
-                'CREATE INDEX IF NOT EXISTS ix_episode_1 ON episode (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_episode_2 ON episode (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_episode_3 ON season (plex_guid)',
-                'CREATE INDEX IF NOT EXISTS ix_artist_1 ON artist (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_artist_2 ON artist (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_album_1 ON album (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_album_2 ON album (kodi_id)',
-                'CREATE INDEX IF NOT EXISTS ix_track_1 ON track (last_sync)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_track_2 ON track (kodi_id)',
                 'CREATE UNIQUE INDEX IF NOT EXISTS ix_playlists_2 ON playlists (kodi_path)',
                 'CREATE INDEX IF NOT EXISTS ix_playlists_3 ON playlists (kodi_hash)',
             )
             for cmd in commands:
                 plexdb.cursor.execute(cmd)
+            # Also re-creates the indexes of an interrupted bulk-load
+            for _, cmd in SECONDARY_INDEXES:
+                plexdb.cursor.execute(cmd)
+
+
+def drop_secondary_indexes():
+    """
+    Drops the SECONDARY_INDEXES in order to speed up bulk-loading an (almost)
+    empty Plex DB. Be sure to call create_secondary_indexes() afterwards
+    """
+    with PlexDBBase() as plexdb:
+        for name, _ in SECONDARY_INDEXES:
+            plexdb.cursor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+def create_secondary_indexes():
+    """
+    Re-creates the SECONDARY_INDEXES after bulk-loading
+    """
+    with PlexDBBase() as plexdb:
+        for _, cmd in SECONDARY_INDEXES:
+            plexdb.cursor.execute(cmd)
 
 
 def wipe(table=None):
@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import json
+
 
 class Sections(object):
     def all_sections(self):
@@ -17,7 +19,8 @@ class Sections(object):
             plex_type TEXT,
             kodi_tagid INTEGER,
             sync_to_kodi BOOL,
-            last_sync INTEGER
+            last_sync INTEGER,
+            digest DICT
         """
         self.cursor.execute('SELECT * FROM sections WHERE section_id = ? LIMIT 1',
                             (section_id, ))
@@ -33,7 +36,8 @@ class Sections(object):
             'plex_type': entry[2],
             'kodi_tagid': entry[3],
             'sync_to_kodi': entry[4] == 1,
-            'last_sync': entry[5]
+            'last_sync': entry[5],
+            'digest': json.loads(entry[6]) if entry[6] else {}
         }
 
     def section_id_by_name(self, section_name):
@@ -48,10 +52,11 @@ class Sections(object):
             pass
 
     def add_section(self, section_id, section_name, plex_type, kodi_tagid,
-                    sync_to_kodi, last_sync):
+                    sync_to_kodi, last_sync, digest=None):
         """
         Appends a Plex section to the Plex sections table
         sync=False: Plex library won't be synced to Kodi
+        digest: dict, see update_section_digest
         """
         query = '''
             INSERT OR REPLACE INTO sections(
@@ -60,8 +65,9 @@ class Sections(object):
                 plex_type,
                 kodi_tagid,
                 sync_to_kodi,
-                last_sync)
-            VALUES (?, ?, ?, ?, ?, ?)
+                last_sync,
+                digest)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             '''
         self.cursor.execute(query,
                             (section_id,
@@ -69,7 +75,8 @@ class Sections(object):
                              plex_type,
                              kodi_tagid,
                              sync_to_kodi,
-                             last_sync))
+                             last_sync,
+                             json.dumps(digest) if digest else None))
 
     def update_section(self, section_id, section_name):
         """
@@ -99,7 +106,7 @@ class Sections(object):
             # Set last_sync = 0 in order to force a full sync if reactivated
             query = '''
                 UPDATE sections
-                SET sync_to_kodi = ?, last_sync = 0
+                SET sync_to_kodi = ?, last_sync = 0, digest = NULL
                 WHERE section_id = ?
             '''
         self.cursor.execute(query, (sync_to_kodi, section_id))
@@ -111,8 +118,45 @@ class Sections(object):
         self.cursor.execute('UPDATE sections SET last_sync = ? WHERE section_id = ?',
                             (last_sync, section_id))
 
+    def update_section_digest(self, section_id, digest):
+        """
+        Saves the digest dict {plex_type: [number of items, max. updatedAt,
+        hash]} for the section, see PlexDBBase.section_digest
+        """
+        self.cursor.execute('UPDATE sections SET digest = ? WHERE section_id = ?',
+                            (json.dumps(digest), section_id))
+
     def force_full_sync(self):
         """
         Sets the last_sync flag to 0 for every section
         """
-        self.cursor.execute('UPDATE sections SET last_sync = 0')
+        self.cursor.execute('UPDATE sections SET last_sync = 0, digest = NULL')
+        self.clear_sync_checkpoints()
+
+    def sync_checkpoints(self):
+        """
+        Returns a dict {(section_id, plex_type): (phase, position,
+        sync_started)} with the checkpoints an interrupted full sync left
+        """
+        self.cursor.execute('SELECT * FROM sync_checkpoints')
+        return {(x[0], x[1]): (x[2], x[3], x[4])
+                for x in self.cursor.fetchall()}
+
+    def set_sync_checkpoint(self, section_id, plex_type, phase, position,
+                            sync_started):
+        """
+        Remembers how far the full sync that started at sync_started got with
+        the section's plex_type items. position is the plex_id of the last
+        item that has been committed
+        """
+        self.cursor.execute('''
+            INSERT OR REPLACE INTO sync_checkpoints(
+                section_id, plex_type, phase, position, sync_started)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (section_id, plex_type, phase, position, sync_started))
+
+    def clear_sync_checkpoints(self):
+        """
+        Call once a full sync has finished completely
+        """
+        self.cursor.execute('DELETE FROM sync_checkpoints')
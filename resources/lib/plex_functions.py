@@ -4,16 +4,26 @@ from logging import getLogger
 from ast import literal_eval
 from copy import deepcopy
 from time import time
-from threading import Thread
+from threading import Thread, Condition, Lock
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 from .downloadutils import DownloadUtils as DU, exceptions
 from . import backgroundthread, utils, plex_tv, variables as v, app
 from . import metadata_cache
+from .circuit_breaker import SYNC, WIDGET, PLAYBACK
 
 ###############################################################################
 LOG = getLogger('PLEX.plex_functions')
 
 CONTAINERSIZE = int(utils.settings('limitindex'))
+# Download section listings and metadata batches as JSON, see plex_json
+JSON_TRANSPORT = utils.settings('enableJsonTransport') == 'true'
+# Long-lived pool for GetPlexMetadataBatch, sized syncThreadNumber. Caps how
+# many metadata batches PKC downloads at once, process-wide
+_BATCH_EXECUTOR = None
+_BATCH_EXECUTOR_LOCK = Lock()
 
 # For discovery of PMS in the local LAN
 PLEX_GDM_IP = b'239.0.0.250'  # multicast to PMS
@@ -23,9 +33,25 @@ PLEX_GDM_MSG = b'M-SEARCH * HTTP/1.0'
 # Field Filter Constants for Response Optimization (PKC 4.0)
 # Reduces bandwidth by 90-100x by only requesting needed fields
 WIDGET_FIELDS = 'title,year,thumb,rating,ratingKey,art,duration,playViewOffset,grandparentTitle,parentTitle,index,parentIndex,type,summary'
-SYNC_FIELDS = 'ratingKey,updatedAt,title,type'
+SYNC_FIELDS = 'ratingKey,updatedAt,addedAt,type'
+USERDATA_FIELDS = 'ratingKey,type,duration,viewCount,viewOffset,lastViewedAt,userRating'
 DETAIL_FIELDS = None  # All fields for detail views
 
+# Arguments for /library/metadata/<id(s)>, for single items and batches alike
+METADATA_ARGUMENTS = {
+    'checkFiles': 0,
+    'includeExtras': 1,         # Trailers and Extras => Extras
+    'includeReviews': 1,
+    'includeRelated': 0,        # Similar movies => Video -> Related
+    'skipRefresh': 1,
+    'includeMarkers': 1,        # e.g. start + stop of intros
+    # 'includeRelatedCount': 0,
+    # 'includeOnDeck': 1,
+    # 'includeChapters': 1,
+    # 'includePopularLeaves': 1,
+    # 'includeConcerts': 1
+}
+
 ###############################################################################
 
 
@@ -482,7 +508,7 @@ def _poke_pms(pms, queue):
 
 
 def GetPlexMetadata(key, reraise=False, includeFields=None, use_cache=True,
-                    cache_type=None):
+                    cache_type=None, revalidate=False, request_class=None):
     """
     Returns raw API metadata for key as an etree XML.
 
@@ -496,6 +522,10 @@ def GetPlexMetadata(key, reraise=False, includeFields=None, use_cache=True,
                        Use WIDGET_FIELDS, SYNC_FIELDS constants or None for all fields
         use_cache: Whether to use smart caching (PKC 4.2, default: True)
         cache_type: Cache type for TTL selection (widget, detail, sync)
+        revalidate: Cache the answer on disk and only download it again if
+                    it changed, see http_cache
+        request_class: Retry policy if the PMS can't be reached, see
+                       circuit_breaker
 
     Returns None or 401 if something went wrong
     """
@@ -533,25 +563,15 @@ def GetPlexMetadata(key, reraise=False, includeFields=None, use_cache=True,
         url = "{server}" + key
     else:
         url = "{server}/library/metadata/" + key
-    arguments = {
-        'checkFiles': 0,
-        'includeExtras': 1,         # Trailers and Extras => Extras
-        'includeReviews': 1,
-        'includeRelated': 0,        # Similar movies => Video -> Related
-        'skipRefresh': 1,
-        'includeMarkers': 1,        # e.g. start + stop of intros
-        # 'includeRelatedCount': 0,
-        # 'includeOnDeck': 1,
-        # 'includeChapters': 1,
-        # 'includePopularLeaves': 1,
-        # 'includeConcerts': 1
-    }
+    arguments = dict(METADATA_ARGUMENTS)
     # PKC 4.0: Add field filtering to reduce bandwidth
     if includeFields:
         arguments['includeFields'] = includeFields
     try:
         xml = DU().downloadUrl(utils.extend_url(url, arguments),
-                               reraise=reraise)
+                               reraise=reraise,
+                               revalidate=revalidate,
+                               request_class=request_class)
     except exceptions.RequestException:
         # "PMS offline"
         utils.dialog('notification',
@@ -595,7 +615,8 @@ def get_playback_xml(url, server_name, authenticate=True, token=None):
         xml = DU().downloadUrl(url,
                                authenticate=authenticate,
                                headerOptions=header_options,
-                               reraise=True)
+                               reraise=True,
+                               request_class=PLAYBACK)
     except exceptions.RequestException:
         # "{0} offline"
         utils.dialog('notification',
@@ -649,7 +670,10 @@ class ThreadedDownloadChunk(backgroundthread.Task):
         super(ThreadedDownloadChunk, self).__init__()
 
     def run(self):
-        xml = DU().downloadUrl(self.url, parameters=self.args)
+        xml = DU().downloadUrl(self.url,
+                               parameters=self.args,
+                               json_transport=JSON_TRANSPORT,
+                               request_class=SYNC)
         try:
             xml.attrib
         except AttributeError:
@@ -659,11 +683,28 @@ class ThreadedDownloadChunk(backgroundthread.Task):
         self.callback(xml)
 
 
+class _Chunk(object):
+    """
+    Placeholder for one downloaded chunk of xml children. Reserved in the
+    order the chunks are requested; children is None until the download
+    finished (an empty list if it failed)
+    """
+    __slots__ = ('children', )
+
+    def __init__(self):
+        self.children = None
+
+
 class DownloadGen(object):
     """
     Special iterator object that will yield all child xmls piece-wise. It also
     saves the original xml.attrib.
 
+    Up to cache_factor chunks are downloaded ahead of time. They are queued in
+    the order they were requested and each chunk is dropped as soon as all of
+    its children have been yielded - memory use is bounded by the prefetch
+    window, not by the size of the section.
+
     Yields XML etree children or raises RuntimeError at the end
     """
     def __init__(self, url, plex_type, last_viewed_at, updated_at, args,
@@ -687,28 +728,68 @@ class DownloadGen(object):
         if includeFields:
             url = '%sincludeFields=%s&' % (url, includeFields)
         self.url = url[:-1]
+        # Chunks that have been requested, in the order of their position
+        self._chunks = deque()
+        self._condition = Condition()
         _blocking_download_chunk(self.url, self.args, 0, self.set_xml)
         self.attrib = self.xml.attrib
         self.current = 0
         self.total = int(self.attrib['totalSize'])
         self.cache_factor = 10
-        # Will keep track whether we still have results incoming
-        self.pending_counter = []
-        end = min(self.cache_factor * CONTAINERSIZE,
-                  self.total + CONTAINERSIZE - self.total % CONTAINERSIZE)
-        for pos in range(CONTAINERSIZE, end, CONTAINERSIZE):
-            self.pending_counter.append(None)
-            self._downloader(self.url, self.args, pos, self.on_chunk_downloaded)
+        # Position of the next chunk we need to request from the PMS
+        self._next_start = CONTAINERSIZE
+        # Only keep the root's attributes around, not its children
+        self._children = iter(list(self.xml))
+        del self.xml[:]
+        self._request_chunks()
 
     def set_xml(self, xml):
         self.xml = xml
 
-    def on_chunk_downloaded(self, xml):
-        if xml is not None:
-            self.xml.extend(xml)
-        else:
-            self.successful = False
-        self.pending_counter.pop()
+    def _request_chunks(self):
+        """
+        Fills the prefetch window. Never call while holding self._condition as
+        the downloader might call back synchronously
+        """
+        requests = []
+        with self._condition:
+            while (len(self._chunks) < self.cache_factor - 1 and
+                   self._next_start < self.total):
+                chunk = _Chunk()
+                self._chunks.append(chunk)
+                requests.append((self._next_start, chunk))
+                self._next_start += CONTAINERSIZE
+        for start, chunk in requests:
+            self._downloader(self.url,
+                             self.args,
+                             start,
+                             partial(self.on_chunk_downloaded, chunk))
+
+    def on_chunk_downloaded(self, chunk, xml):
+        with self._condition:
+            if xml is not None:
+                chunk.children = list(xml)
+            else:
+                self.successful = False
+                chunk.children = []
+            self._condition.notify_all()
+
+    def _next_chunk(self):
+        """
+        Blocks until the next chunk in line has been downloaded. Returns False
+        if there are no chunks left
+        """
+        with self._condition:
+            while self._chunks and self._chunks[0].children is None:
+                LOG.debug('Waiting for download to finish')
+                self._condition.wait(1.0)
+                if app.APP.monitor.abortRequested():
+                    raise StopIteration('PKC needs to exit now')
+            if not self._chunks:
+                return False
+            self._children = iter(self._chunks.popleft().children)
+        self._request_chunks()
+        return True
 
     def get(self, key, default=None):
         """
@@ -722,27 +803,16 @@ class DownloadGen(object):
     def __next__(self):
         while True:
             try:
-                child = self.xml[0]
-                self.current += 1
-                self.xml.remove(child)
-                if (self.current % CONTAINERSIZE == 0 and
-                        self.current <= self.total - (self.cache_factor - 1) * CONTAINERSIZE):
-                    self.pending_counter.append(None)
-                    self._downloader(
-                        self.url,
-                        self.args,
-                        self.current + (self.cache_factor - 1) * CONTAINERSIZE,
-                        self.on_chunk_downloaded)
-                return child
-            except IndexError:
-                if not self.pending_counter and not len(self.xml):
+                child = next(self._children)
+            except StopIteration:
+                if not self._next_chunk():
                     if not self.successful:
                         raise RuntimeError('Could not download everything')
                     else:
                         raise StopIteration()
-            LOG.debug('Waiting for download to finish')
-            if app.APP.monitor.waitForAbort(0.1):
-                raise StopIteration('PKC needs to exit now')
+            else:
+                self.current += 1
+                return child
 
     next = __next__
 
@@ -752,7 +822,10 @@ def _blocking_download_chunk(url, args, start, callback):
     callback will be called with the downloaded xml (fragment)
     """
     args['X-Plex-Container-Start'] = start
-    xml = DU().downloadUrl(url, parameters=args)
+    xml = DU().downloadUrl(url,
+                           parameters=args,
+                           json_transport=JSON_TRANSPORT,
+                           request_class=SYNC)
     try:
         xml.attrib
     except AttributeError:
@@ -773,6 +846,10 @@ def _async_download_chunk(url, args, start, callback):
 
 def get_section_iterator(section_id, plex_type=None, last_viewed_at=None,
                          updated_at=None, args=None, includeFields=None):
+    """
+    includeFields: the attributes to request for every item, e.g. SYNC_FIELDS.
+    None requests everything. See library_sync.common.phase_fields
+    """
     args = args or {}
     args.update({
         'checkFiles': 0,
@@ -782,10 +859,6 @@ def get_section_iterator(section_id, plex_type=None, last_viewed_at=None,
         'skipRefresh': 1,  # don't scan
         'excludeAllLeaves': 1  # PMS wont attach a first summary child
     })
-    # PKC 4.0.6: Default to WIDGET_FIELDS for 90-100x bandwidth reduction
-    # Can be disabled via settings if it causes issues
-    if includeFields is None and utils.settings('enableReduceBandwidth') == 'true':
-        includeFields = WIDGET_FIELDS
     if plex_type == v.PLEX_TYPE_ALBUM:
         # Kodi sorts Newest Albums by their position within the Kodi music
         # database - great...
@@ -809,6 +882,35 @@ def get_section_iterator(section_id, plex_type=None, last_viewed_at=None,
                        includeFields)
 
 
+def get_section_digest(section_id, plex_type):
+    """
+    Returns the tuple (number of items, max. updatedAt) for the plex_type
+    items of section section_id - with one single, tiny request. Returns None
+    if that did not work
+    """
+    if plex_type in (v.PLEX_TYPE_EPISODE, v.PLEX_TYPE_SONG):
+        url = '{server}/library/sections/%s/allLeaves' % section_id
+        args = {}
+    else:
+        url = '{server}/library/sections/%s/all' % section_id
+        args = {'type': v.PLEX_TYPE_NUMBER_FROM_PLEX_TYPE[plex_type]}
+    args.update({
+        'sort': 'updatedAt:desc',
+        'includeFields': 'ratingKey,updatedAt',
+        'X-Plex-Container-Start': 0,
+        'X-Plex-Container-Size': 1
+    })
+    xml = DU().downloadUrl(url, parameters=args, request_class=SYNC)
+    try:
+        number_of_items = int(xml.attrib['totalSize'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        LOG.warn('Could not get the digest for section %s, %s',
+                 section_id, plex_type)
+        return
+    updated_at = utils.cast(int, xml[0].get('updatedAt')) if len(xml) else 0
+    return number_of_items, updated_at or 0
+
+
 def DownloadChunks(url):
     """
     Downloads PMS url in chunks of CONTAINERSIZE.
@@ -855,6 +957,96 @@ def DownloadChunks(url):
     return xml
 
 
+def _batch_executor():
+    """
+    Returns the long-lived thread pool shared by all batch metadata downloads
+    """
+    global _BATCH_EXECUTOR
+    with _BATCH_EXECUTOR_LOCK:
+        if _BATCH_EXECUTOR is None:
+            workers = int(utils.settings('syncThreadNumber'))
+            LOG.debug('Starting %s workers for batch metadata downloads',
+                      workers)
+            _BATCH_EXECUTOR = ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix='PlexMetadataBatch')
+        return _BATCH_EXECUTOR
+
+
+def shutdown_batch_executor():
+    """
+    Stops the batch metadata download threads, e.g. when PKC exits. Batches
+    already downloading are finished, queued ones are dropped
+    """
+    global _BATCH_EXECUTOR
+    with _BATCH_EXECUTOR_LOCK:
+        executor, _BATCH_EXECUTOR = _BATCH_EXECUTOR, None
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def _fetch_metadata_batch(batch):
+    """
+    Downloads the metadata for the Plex ids in batch. Returns a list of
+    metadata XML elements, an empty list on error
+    """
+    ids_param = ','.join(str(item_id) for item_id in batch)
+    # Same arguments as for single items - we need e.g. trailers and markers
+    url = utils.extend_url("{server}/library/metadata/%s" % ids_param,
+                           METADATA_ARGUMENTS)
+    LOG.debug('Batch-requesting metadata for %d items', len(batch))
+    result = []
+    try:
+        xml = DU().downloadUrl(url,
+                               json_transport=JSON_TRANSPORT,
+                               request_class=SYNC)
+        if xml is not None:
+            try:
+                for child in xml:
+                    result.append(child)
+            except (TypeError, AttributeError):
+                LOG.warn('Batch metadata request failed for IDs: %s', ids_param)
+        else:
+            LOG.warn('No response for batch metadata request')
+    except Exception as err:
+        LOG.error('Error during batch metadata request: %s', err)
+    return result
+
+
+def get_metadata_batches(item_ids, batch_size=100, max_workers=4):
+    """
+    Generator downloading the metadata for item_ids in batches of batch_size
+    on the shared batch executor, up to max_workers batches at once. Yields a
+    list of metadata XML elements per batch (empty on error), in the order of
+    item_ids, as soon as the batch has been downloaded - start processing
+    while later batches are still in flight.
+
+    Closing the generator early drops the batches not yet started
+    """
+    batches = [item_ids[i:i + batch_size]
+               for i in range(0, len(item_ids), batch_size)]
+    if not batches:
+        return
+    executor = _batch_executor()
+    pending = deque()
+    next_batch = 0
+    try:
+        while pending or next_batch < len(batches):
+            while (next_batch < len(batches) and
+                    len(pending) < max(1, max_workers)):
+                pending.append(executor.submit(_fetch_metadata_batch,
+                                               batches[next_batch]))
+                next_batch += 1
+            try:
+                yield pending.popleft().result()
+            except Exception as err:
+                LOG.error('Batch metadata request failed: %s', err)
+                yield []
+    finally:
+        for future in pending:
+            future.cancel()
+
+
 def GetPlexMetadataBatch(item_ids, batch_size=100, parallel=True, max_workers=4):
     """
     Get metadata for multiple items efficiently in batches (PKC 4.0)
@@ -871,69 +1063,22 @@ def GetPlexMetadataBatch(item_ids, batch_size=100, parallel=True, max_workers=4)
         max_workers: Maximum concurrent requests (default 4)
     
     Returns:
-        List of metadata XML elements, or empty list on error
+        List of metadata XML elements, or empty list on error. Use
+        get_metadata_batches() to process the batches as they arrive
     
     Example:
         metadata_list = GetPlexMetadataBatch([1234, 1235, 1236])
         for metadata in metadata_list:
             process_item(metadata)
     """
-    if not item_ids:
-        return []
-    
-    # Split into batches
-    batches = []
-    for i in range(0, len(item_ids), batch_size):
-        batch = item_ids[i:i+batch_size]
-        batches.append(batch)
-    
     all_metadata = []
-    
-    def fetch_batch(batch):
-        """Fetch a single batch of metadata"""
-        ids_param = ','.join(str(item_id) for item_id in batch)
-        url = "{server}/library/metadata/%s" % ids_param
-        LOG.debug('Batch-requesting metadata for %d items', len(batch))
-        
-        result = []
-        try:
-            xml = DU().downloadUrl(url)
-            if xml is not None:
-                try:
-                    for child in xml:
-                        result.append(child)
-                except (TypeError, AttributeError):
-                    LOG.warn('Batch metadata request failed for IDs: %s', ids_param)
-            else:
-                LOG.warn('No response for batch metadata request')
-        except Exception as err:
-            LOG.error('Error during batch metadata request: %s', err)
-        return result
-    
-    if parallel and len(batches) > 1:
-        # PKC 4.1: Parallel batch requests for 2-4x additional speedup
-        from concurrent.futures import ThreadPoolExecutor, as_completed
-        LOG.debug('Using parallel batch requests with %d workers for %d batches', 
-                  max_workers, len(batches))
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            future_to_batch = {executor.submit(fetch_batch, batch): batch 
-                              for batch in batches}
-            for future in as_completed(future_to_batch):
-                try:
-                    result = future.result()
-                    all_metadata.extend(result)
-                except Exception as err:
-                    LOG.error('Parallel batch request failed: %s', err)
-    else:
-        # Sequential processing for single batch or when parallel disabled
-        for batch in batches:
-            result = fetch_batch(batch)
-            all_metadata.extend(result)
-    
-    LOG.info('Batch-loaded %d metadata items from %d requests%s', 
-             len(all_metadata), len(batches),
-             ' (parallel)' if parallel and len(batches) > 1 else '')
+    for result in get_metadata_batches(item_ids,
+                                       batch_size,
+                                       max_workers if parallel else 1):
+        all_metadata.extend(result)
+    LOG.info('Batch-loaded %d metadata items for %d ids%s',
+             len(all_metadata), len(item_ids),
+             ' (parallel)' if parallel else '')
     return all_metadata
 
 
@@ -944,14 +1089,36 @@ def GetPlexOnDeck(viewId):
 
 
 def get_plex_hub():
-    return DU().downloadUrl('{server}/hubs')
+    return DU().downloadUrl('{server}/hubs',
+                            revalidate=True,
+                            request_class=WIDGET)
+
+
+def get_hub_items(key, count):
+    """
+    Returns the (up to count) items of the home hub key, e.g.
+    '/hubs/home/continueWatching', or an empty list. Every item carries its
+    librarySectionID
+    """
+    xml = DU().downloadUrl(utils.extend_url('{server}%s' % key,
+                                            {'count': count}),
+                           request_class=SYNC)
+    try:
+        xml.attrib
+    except AttributeError:
+        LOG.warn('Could not download hub %s', key)
+        return []
+    if xml.find('Hub') is not None:
+        # The PMS wrapped the items in one or several hubs
+        return [x for hub in xml.findall('Hub') for x in hub]
+    return list(xml)
 
 
 def get_plex_sections():
     """
     Returns all Plex sections (libraries) of the PMS as an etree xml
     """
-    xml = DU().downloadUrl('{server}/library/sections')
+    xml = DU().downloadUrl('{server}/library/sections', request_class=SYNC)
     try:
         xml[0].attrib
     except (TypeError, IndexError, AttributeError):
@@ -1277,7 +1444,8 @@ def playback_decision(path, media, part, playmethod, video=True, args=None):
               arguments)
     return DU().downloadUrl(utils.extend_url(url, arguments),
                             headerOptions=v.STREAMING_HEADERS,
-                            reraise=True)
+                            reraise=True,
+                            request_class=PLAYBACK)
 
 
 def change_subtitle(plex_stream_id, part_id):
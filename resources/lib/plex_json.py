@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+PMS answers in JSON (Accept: application/json) wrapped to look like the
+etree elements of the XML answers.
+
+JsonElement offers the part of the etree.Element interface that plex_api.API,
+DownloadGen and library sync use: tag, attrib, get(), set(), iteration,
+indexing and slicing of the children, find(), findall() and iterfind() by
+tag. Attribute values are strings, just like in the XML answers.
+
+Deliberately free of Kodi imports so the benchmark can run standalone.
+"""
+import json
+
+MIME_TYPE = 'application/json'
+# JSON puts all items in a "Metadata" list - the XML element's tag depends on
+# the item's type
+TAG_FROM_TYPE = {
+    'movie': 'Video',
+    'episode': 'Video',
+    'clip': 'Video',
+    'track': 'Track',
+    'photo': 'Photo',
+    'playlist': 'Playlist',
+}
+DEFAULT_METADATA_TAG = 'Directory'
+
+
+class JsonElement(list):
+    """
+    The children of the element are the list items
+    """
+    __slots__ = ('tag', 'attrib')
+    text = None
+
+    def __init__(self, tag, attrib=None, children=()):
+        super(JsonElement, self).__init__(children)
+        self.tag = tag
+        self.attrib = attrib if attrib is not None else {}
+
+    def __reduce__(self):
+        # Support copy.deepcopy and pickling
+        return (JsonElement, (self.tag, self.attrib, list(self)))
+
+    # Compare by identity like etree elements, e.g. for remove()
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return '<JsonElement %s %s>' % (self.tag, self.attrib)
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def set(self, key, value):
+        self.attrib[key] = value
+
+    def keys(self):
+        return self.attrib.keys()
+
+    def items(self):
+        return self.attrib.items()
+
+    def iterfind(self, path):
+        """
+        Only supports paths 'Tag' and './Tag'
+        """
+        if path.startswith('./'):
+            path = path[2:]
+        return (x for x in self if x.tag == path)
+
+    def findall(self, path):
+        return list(self.iterfind(path))
+
+    def find(self, path):
+        return next(self.iterfind(path), None)
+
+    def iter(self, tag=None):
+        if tag is None or self.tag == tag:
+            yield self
+        for child in self:
+            for element in child.iter(tag):
+                yield element
+
+
+def _attribute(value):
+    if value is True:
+        return '1'
+    elif value is False:
+        return '0'
+    return str(value)
+
+
+def _element(tag, obj):
+    attrib = {}
+    media = []
+    children = []
+    for key, value in obj.items():
+        if isinstance(value, list):
+            if not value or not isinstance(value[0], dict):
+                # Lists of plain values have no XML counterpart
+                continue
+            if key == 'Metadata':
+                group = [_element(TAG_FROM_TYPE.get(x.get('type'),
+                                                    DEFAULT_METADATA_TAG), x)
+                         for x in value]
+            else:
+                group = [_element(key, x) for x in value]
+            if key == 'Media':
+                # plex_api expects the Media elements to come first
+                media.extend(group)
+            else:
+                children.extend(group)
+        elif isinstance(value, dict):
+            children.append(_element(key, value))
+        elif value is not None:
+            attrib[key] = _attribute(value)
+    return JsonElement(tag, attrib, media + children)
+
+
+def loads(content):
+    """
+    Turns the PMS' JSON answer content [bytes or str] into a JsonElement,
+    e.g. the MediaContainer. Raises ValueError if content is not valid JSON
+    """
+    data = json.loads(content)
+    if not isinstance(data, dict) or len(data) != 1:
+        raise ValueError('Unexpected JSON answer')
+    tag, obj = next(iter(data.items()))
+    return _element(tag, obj)
+
+
+def is_json(content):
+    """
+    True if the PMS' answer content [bytes] looks like JSON, not XML
+    """
+    return content.lstrip()[:1] == b'{'
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+One token bucket shared by all requests PKC sends to the PMS from this Python
+instance, so that library sync can't hog the PMS while the user is browsing or
+playing something.
+
+The bucket refills with rate tokens per second and holds at most burst tokens.
+Every request takes one token. Requests of a class with a higher priority
+(lower number in PRIORITIES) pre-empt waiting requests of lower priority:
+background sync only gets a token once no interactive request is waiting.
+"""
+from logging import getLogger
+from threading import Condition
+import time
+
+from .circuit_breaker import SYNC, WIDGET, PLAYBACK, COMPANION, OTHER
+
+LOG = getLogger('PLEX.rate_limiter')
+
+# Lower number = higher priority
+PRIORITIES = {
+    PLAYBACK: 0,
+    COMPANION: 0,
+    WIDGET: 0,
+    OTHER: 1,
+    SYNC: 2,
+}
+LEVELS = max(PRIORITIES.values()) + 1
+# Seconds of requests the bucket can save up
+BURST_SECONDS = 2
+
+
+class RateLimiter(object):
+    def __init__(self):
+        self.cond = Condition()
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self.stamp = time.time()
+        self.waiting = [0] * LEVELS
+        self.counters = {}
+
+    def configure(self, rate):
+        """
+        Allow rate requests per second on average. rate=0 switches the
+        limiter off
+        """
+        with self.cond:
+            self.rate = max(0, rate)
+            self.burst = max(1, self.rate * BURST_SECONDS)
+            self.tokens = float(self.burst)
+            self.stamp = time.time()
+            self.cond.notify_all()
+        LOG.debug('Limiting PMS requests to %s per second',
+                  self.rate or 'unlimited')
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def acquire(self, request_class):
+        """
+        Blocks until a request of request_class may be sent. Returns the
+        seconds we waited
+        """
+        priority = PRIORITIES.get(request_class, PRIORITIES[OTHER])
+        start = time.time()
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while self.rate:
+                    self._refill()
+                    if (self.tokens >= 1 and
+                            not any(self.waiting[:priority])):
+                        self.tokens -= 1
+                        break
+                    # Check again once the next token should be available
+                    self.cond.wait(max(0.01, (1 - self.tokens) / self.rate))
+            finally:
+                self.waiting[priority] -= 1
+                # Lower priorities might be able to proceed now
+                self.cond.notify_all()
+            waited = time.time() - start
+            self._count(request_class, waited)
+        return waited
+
+    def _count(self, request_class, waited):
+        counters = self.counters.setdefault(request_class or OTHER,
+                                            {'requests': 0,
+                                             'waited': 0,
+                                             'wait_time': 0.0,
+                                             'max_wait': 0.0})
+        counters['requests'] += 1
+        if waited >= 0.001:
+            counters['waited'] += 1
+            counters['wait_time'] += waited
+            counters['max_wait'] = max(counters['max_wait'], waited)
+
+    def stats(self):
+        """
+        Returns a dict with the configuration, the number of requests waiting
+        right now per priority and, per request class, the number of requests,
+        how many of them had to wait and for how long in total and at most
+        """
+        with self.cond:
+            return {
+                'rate': self.rate,
+                'waiting': list(self.waiting),
+                'classes': {k: {'requests': v['requests'],
+                                'waited': v['waited'],
+                                'wait_time': round(v['wait_time'], 2),
+                                'max_wait': round(v['max_wait'], 2)}
+                            for k, v in self.counters.items()}
+            }
+
+
+LIMITER = RateLimiter()
@@ -21,6 +21,7 @@ from . import loghandler
 from . import backgroundthread
 from . import skip_plex_markers
 from . import downloadutils
+from . import http_stats, http_cache, circuit_breaker, rate_limiter
 from .windows import userselect
 
 ###############################################################################
@@ -180,6 +181,8 @@ class Service(object):
         app.APP.suspend_threads()
         LOG.info('Successfully suspended threads')
         app.ACCOUNT.log_out()
+        # Cached answers belong to the old user and PMS
+        http_cache.clear()
         LOG.info('User has been logged out')
 
     def choose_pms_server(self, manual=False):
@@ -334,6 +337,26 @@ class Service(object):
         LOG.info("Entering PMS address complete")
         return True
 
+    @staticmethod
+    def dump_http_stats():
+        """
+        Writes the PMS request statistics to addon_data, see http_stats
+        """
+        return http_stats.dump(
+            connection_pools=downloadutils.DownloadUtils().pool_stats(),
+            circuit_breakers=circuit_breaker.stats(),
+            rate_limiter=rate_limiter.LIMITER.stats(),
+            http_cache=http_cache.stats())
+
+    def show_http_stats(self):
+        data = self.dump_http_stats()
+        LOG.info('PMS request statistics written to %s', v.HTTP_STATS_FILE)
+        # "PMS request statistics"
+        utils.dialog('textviewer',
+                     utils.lang(30576),
+                     http_stats.summary(data),
+                     usemono=True)
+
     def choose_plex_libraries(self):
         if not app.CONN.online:
             LOG.error('PMS not online to choose libraries')
@@ -560,6 +583,9 @@ class Service(object):
                 elif plex_command == 'generate_new_uuid':
                     LOG.info('Generating new UUID for PKC')
                     clientinfo.getDeviceId(reset=True)
+                elif plex_command == 'http-stats':
+                    task = backgroundthread.FunctionAsTask(
+                        self.show_http_stats, None)
                 else:
                     raise RuntimeError('Unknown command: %s', plex_command)
                 if task:
@@ -630,6 +656,10 @@ class Service(object):
         library_sync.clear_window_vars()
         # Will block until threads have quit
         app.APP.stop_threads()
+        PF.shutdown_batch_executor()
+        self.dump_http_stats()
+        http_cache.flush_stats()
+        LOG.info('Settings reads: %s', utils.settings_stats())
         # CLEANUP
         # Kodi's xbmc.Monitor() stalls
         # delete xbmc.Player() just to be sure
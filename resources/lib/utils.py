@@ -8,6 +8,7 @@ from sqlite3 import OperationalError
 from datetime import datetime
 from unicodedata import normalize
 from threading import Lock
+from collections import Counter
 import urllib
 # even with the above import urllib, Python3 sometimes runs into this issue
 # AttributeError: module 'urllib' has no attribute 'parse'
@@ -36,6 +37,14 @@ ADDON = xbmcaddon.Addon(id='plugin.video.plexkodiconnect')
 # If several threads access  the settings.xml file concurrently, it gets
 # corrupted
 SETTINGS_LOCK = Lock()
+# Snapshot {setting: value} of the settings we've read so far. Never modified,
+# only replaced (holding SETTINGS_LOCK) - readers don't need any lock. Emptied
+# whenever Kodi tells us that the settings changed, see refresh_settings()
+_SETTINGS = {}
+# How often each setting was read. Approximate, as threads increment without
+# a lock
+_SETTINGS_READS = Counter()
+_SETTINGS_STATS = {'misses': 0, 'writes': 0, 'refreshes': 0}
 
 # Grab Plex id from '...plex_id=XXXX....'
 REGEX_PLEX_ID = re.compile(r'''plex_id=(\d+)''')
@@ -112,16 +121,57 @@ def settings(setting, value=None):
     Get or add addon setting. Returns unicode
 
     setting and value can either be unicode or string
+
+    Reads are answered from the settings snapshot; only the first read of a
+    setting after a change goes to Kodi's Addon API. Writes always go
+    through the Addon API
     """
+    global _SETTINGS
+    if value is None:
+        _SETTINGS_READS[setting] += 1
+        try:
+            return _SETTINGS[setting]
+        except KeyError:
+            pass
     # We need to instantiate every single time to read changed variables!
     with SETTINGS_LOCK:
         addon = xbmcaddon.Addon('plugin.video.plexkodiconnect')
         if value is not None:
             # Takes string or unicode by default!
             addon.setSetting(setting, value)
+            _SETTINGS_STATS['writes'] += 1
         else:
-            # Should return unicode by default, but just in case
-            return addon.getSetting(setting)
+            _SETTINGS_STATS['misses'] += 1
+        # Should return unicode by default, but just in case
+        current = addon.getSetting(setting)
+        snapshot = dict(_SETTINGS)
+        snapshot[setting] = current
+        _SETTINGS = snapshot
+    if value is None:
+        return current
+
+
+def refresh_settings():
+    """
+    Drops the settings snapshot, e.g. because the user changed PKC's settings.
+    Settings will be read from Kodi again
+    """
+    global _SETTINGS
+    with SETTINGS_LOCK:
+        _SETTINGS = {}
+        _SETTINGS_STATS['refreshes'] += 1
+
+
+def settings_stats(top=15):
+    """
+    Returns a dict with the number of settings reads, how many of them had to
+    ask Kodi (misses), writes, snapshot refreshes and the top most read
+    settings
+    """
+    result = dict(_SETTINGS_STATS)
+    result['reads'] = sum(_SETTINGS_READS.values())
+    result['top'] = _SETTINGS_READS.most_common(top)
+    return result
 
 
 def lang(stringid):
@@ -154,7 +204,8 @@ def yesno_dialog(heading, msg):
 def dialog(typus, *args, **kwargs):
     """
     Displays xbmcgui Dialog. Pass a string as typus:
-        'yesno', 'ok', 'notification', 'input', 'select', 'numeric'
+        'yesno', 'ok', 'notification', 'input', 'select', 'numeric',
+        'textviewer'
     kwargs:
         heading='{plex}'        title bar (here PlexKodiConnect)
         message=lang(30128),    Dialog content
@@ -216,7 +267,8 @@ def dialog(typus, *args, **kwargs):
         'input': dia.input,
         'select': dia.select,
         'numeric': dia.numeric,
-        'contextmenu': dia.contextmenu
+        'contextmenu': dia.contextmenu,
+        'textviewer': dia.textviewer
     }
     return types[typus](*args, **kwargs)
 
@@ -554,6 +606,8 @@ def reset(ask_user=True):
 
     # Wipe everything
     wipe_database()
+    from . import http_cache
+    http_cache.clear()
     reboot_kodi()
 
 
@@ -114,9 +114,19 @@ DB_TEXTURE_VERSION = None
 DB_TEXTURE_PATH = None
 DB_PLEX_PATH = xbmcvfs.translatePath("special://database/plex.db")
 DB_PLEX_COPY_PATH = xbmcvfs.translatePath("special://database/plex-copy.db")
+DB_VIDEO_STAGING_PATH = xbmcvfs.translatePath(
+    "special://database/plex-staging-video.db")
+DB_MUSIC_STAGING_PATH = xbmcvfs.translatePath(
+    "special://database/plex-staging-music.db")
 
 EXTERNAL_SUBTITLE_TEMP_PATH = xbmcvfs.translatePath(
     "special://profile/addon_data/%s/temp/" % ADDON_ID)
+# Cached PMS answers, see http_cache
+HTTP_CACHE_PATH = xbmcvfs.translatePath(
+    "special://profile/addon_data/%s/http_cache/" % ADDON_ID)
+# Request statistics, see http_stats
+HTTP_STATS_FILE = xbmcvfs.translatePath(
+    "special://profile/addon_data/%s/http_stats.json" % ADDON_ID)
 
 
 # Multiply Plex time by this factor to receive Kodi time